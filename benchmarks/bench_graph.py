@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Times the propagation of updates through a deep chain and a wide fan-out of
+reactive expressions and observers.
+
+The chain is a reactive value followed by a given number of expressions, each
+reading the previous one, and an observer at the end; the fan-out is a reactive
+value read by a given number of observers. Both are run in the classic mode and
+in the cutoff (push-pull) mode.
+
+Usage: PYTHONPATH=. python benchmarks/bench_graph.py [nodes]
+"""
+
+import sys
+import time
+
+from translucent.reactive import Context
+
+
+def chain(n, cutoff):
+    rc = Context(safe=False, cutoff=cutoff)
+    rc.new_value(e0=0)
+    for i in range(1, n):
+        rc.new_expression('e%d' % i, lambda env, i=i: env['e%d' % (i - 1)] + 1)
+    rc.new_observer('o', lambda env: env['e%d' % (n - 1)])
+    return rc
+
+
+def fan_out(n, cutoff):
+    rc = Context(safe=False, cutoff=cutoff)
+    rc.new_value(e0=0)
+    for i in range(n):
+        rc.new_observer('o%d' % i, lambda env: env.e0 + 1)
+    return rc
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def main(n=10000):
+    print '%-24s %10s %10s %10s' % ('graph', 'build, s', 'run, s', 'update, s')
+    for cutoff in (False, True):
+        for name, build in (('chain', chain), ('fan-out', fan_out)):
+            result = {}
+            build_time = timed(lambda: result.setdefault('rc', build(n, cutoff)))
+            rc = result['rc']
+            run_time = timed(rc.run)
+            update_time = timed(lambda: rc.set_value(e0=1))
+            print '%-24s %10.3f %10.3f %10.3f' % ('%s[%d]%s' % (name, n, ' (cutoff)' * cutoff),
+                build_time, run_time, update_time)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
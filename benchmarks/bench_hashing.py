@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compares the registered hashers of translucent.reactive against the generic
+pickle-based ``joblib.hashing.hash()`` path for numpy arrays and pandas objects.
+
+Usage: PYTHONPATH=. python benchmarks/bench_hashing.py [repeat]
+"""
+
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+from joblib import hashing
+
+from translucent.reactive import _fast_hash
+
+
+def cases():
+    rng = np.random.RandomState(0)
+    for n in (10 ** 3, 10 ** 5, 10 ** 7):
+        x = rng.rand(n)
+        yield 'ndarray[%d]' % n, x
+        yield 'ndarray[%d] (strided)' % n, x[::2]
+    for n in (10 ** 3, 10 ** 5, 10 ** 6):
+        yield 'DataFrame[%d x 3]' % n, pd.DataFrame({
+            'a': rng.rand(n),
+            'b': rng.randint(0, 100, n),
+            'c': rng.choice(['x', 'y', 'z'], n)})
+
+
+def main(repeat=5):
+    print '%-28s %12s %12s %8s' % ('value', 'registry, ms', 'joblib, ms', 'speedup')
+    for name, value in cases():
+        fast = min(timeit.repeat(lambda: _fast_hash(value), number=1, repeat=repeat))
+        slow = min(timeit.repeat(lambda: hashing.hash(value), number=1, repeat=repeat))
+        print '%-28s %12.3f %12.3f %7.1fx' % (name, fast * 1e3, slow * 1e3, slow / fast)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
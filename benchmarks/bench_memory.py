@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reports the memory footprint of a reactive context per node.
+
+Builds a context with a given number of nodes (by default 100k: a third of them
+values, a third expressions reading one value each and a third observers reading
+one expression each), runs it and reports the growth of the resident set size
+along with the size of the node objects and their edge containers as measured by
+``sys.getsizeof()``.
+
+Usage: PYTHONPATH=. python benchmarks/bench_memory.py [nodes]
+"""
+
+import gc
+import sys
+
+from translucent.reactive import Context
+
+
+def rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+
+
+def shallow_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    for name in ('parents', 'children'):
+        edges = getattr(obj, name)
+        size += sys.getsizeof(edges)
+        for attr in getattr(edges, '__slots__', ()):
+            size += sys.getsizeof(getattr(edges, attr))
+    for name in ('_cache', '_current_cache'):
+        if getattr(obj, name, None) is not None:
+            size += sys.getsizeof(getattr(obj, name))
+    return size
+
+
+def build(n):
+    k = n // 3
+    rc = Context(safe=False)
+    rc.new_value(**dict(('v%d' % i, i) for i in range(k)))
+    rc.new_expression(**dict(('e%d' % i, lambda env, i=i: env['v%d' % i] + 1)
+        for i in range(k)))
+    rc.new_observer(**dict(('o%d' % i, lambda env, i=i: env['e%d' % i])
+        for i in range(n - 2 * k)))
+    rc.run()
+    return rc
+
+
+def main(n=100000):
+    gc.collect()
+    before = rss()
+    rc = build(n)
+    gc.collect()
+    after = rss()
+    objects = rc._objects.values()
+    print 'nodes:                  %d' % len(objects)
+    print 'rss growth per node:    %.0f bytes' % (float(after - before) / len(objects))
+    print 'node + edges per node:  %.0f bytes' % (
+        float(sum(shallow_size(obj) for obj in objects)) / len(objects))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -33,7 +33,7 @@ class DataframeApp(App):
         return [] if not tags else sorted(set(np.concatenate(tags)) - set([other]))
 
     def on_init(self):
-        self.reactive('table', self.table)
+        self.reactive('table', self.table, pure=True)
         self.reactive('tags1', lambda env: self.get_tags(env, env.tag2), shared=True)
         self.reactive('tags2', lambda env: self.get_tags(env, env.tag1), shared=True)
         self.set_input('tag1', None)
@@ -40,6 +40,8 @@ class App(object):
 
     def on_inputs_init(self, env):
         print 'inputs_init():', env
+        if env:
+            self.context.set_value(_auto_add=True, **env)
 
     def on_input_update(self, key, value):
         print 'input_update():', key, '->', value
@@ -48,14 +50,18 @@ class App(object):
     def set_input(self, key, value):
         self.send_value(key, value, readonly=False)
 
-    def set_value(self, key, value, shared=False):
+    def set_value(self, key, value, shared=False, frozen=False):
         self.context.set_value(key, value, _auto_add=True)
+        if frozen:
+            self.context.freeze(key)
         if shared:
             self.send_value(key, value, readonly=True)
 
-    def reactive(self, key, fn, shared=False):
+    def reactive(self, key, fn, shared=False, pure=False):
         if callable(fn):
             self.context.new_expression(key, fn)
+            if pure:
+                self.context.memoize(key, pure=True)
             if shared:
                 def observer(env):
                     result = fn(env)
@@ -0,0 +1,549 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ('MemoCache', 'CacheBudget', 'DiskStore', 'SharedStore', 'shared_store', 'sizeof',
+    'stable_hash', 'func_key')
+
+import os
+import sys
+import errno
+import shutil
+import hashlib
+import tempfile
+import threading
+import cPickle as pickle
+import joblib
+from joblib import hashing
+
+from ._compat import OrderedDict
+
+
+def stable_hash(obj):
+    """
+    Returns a hash of an arbitrary Python object that is stable across processes.
+
+    Unlike the builtin ``hash()``, the result does not depend on object identity
+    or on the interpreter instance, so it can be used to key persistent caches.
+    """
+    return hashing.hash(obj)
+
+
+def func_key(func):
+    """
+    Returns a string identifying a function by its module, name and bytecode, its
+    default arguments and the values of the variables it closes over, which is
+    stable across processes and changes whenever any of these do. Returns `None` if
+    the defaults or the closure cannot be hashed (see :func:`stable_hash`).
+
+    The defaults and the closure are hashed when the key is computed, so modifying
+    them in place later on does not change the key. Other functions called by the
+    function (other than the ones it closes over) are only identified by their
+    names, so a change to their code does not change the key either.
+    """
+    return _func_key(func, set())
+
+
+def _func_key(func, seen):
+    func = getattr(func, 'im_func', func)
+    name = '%s.%s' % (getattr(func, '__module__', None), getattr(func, '__name__', None))
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return name
+    if id(func) in seen:
+        # a recursive closure
+        return name
+    seen.add(id(func))
+
+    def digest(code, md5):
+        md5.update(code.co_code)
+        md5.update(repr(code.co_names))
+        for const in code.co_consts:
+            if hasattr(const, 'co_code'):
+                digest(const, md5)
+            else:
+                md5.update(repr(const))
+        return md5
+
+    md5 = digest(code, hashlib.md5())
+    values = list(func.__defaults__ or ())
+    for cell in func.__closure__ or ():
+        try:
+            values.append(cell.cell_contents)
+        except ValueError:
+            # the variable is not bound yet
+            values.append(None)
+    for value in values:
+        if hasattr(value, '__code__') or hasattr(value, 'im_func'):
+            key = _func_key(value, seen)
+        else:
+            try:
+                key = stable_hash(value)
+            except Exception:
+                key = None
+        if key is None:
+            return None
+        md5.update(key + '\0')
+    return '%s:%s' % (name, md5.hexdigest())
+
+
+def sizeof(obj, _seen=None):
+    """
+    Returns the approximate size of an arbitrary Python object in bytes.
+
+    Uses ``nbytes`` for numpy arrays and ``memory_usage(deep=True)`` for pandas
+    objects; lists, tuples, sets and dicts are measured recursively, and everything
+    else falls back to ``sys.getsizeof()``.
+    """
+    if hasattr(obj, 'nbytes') and not isinstance(obj, type):
+        try:
+            return int(obj.nbytes)
+        except:
+            pass
+    if hasattr(obj, 'memory_usage') and not isinstance(obj, type):
+        try:
+            usage = obj.memory_usage(deep=True)
+            return int(usage.sum() if hasattr(usage, 'sum') else usage)
+        except:
+            pass
+    _seen = _seen if _seen is not None else set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(x, _seen) for x in obj)
+    return size
+
+
+class CacheBudget(object):
+
+    """
+    Shared limits for a group of memo caches (e.g. all memoized expressions of a
+    reactive context).
+
+    The budget keeps track of the recency of every entry across all of the caches
+    attached to it and evicts the least recently used entries once the total number
+    of entries or their total approximate size exceeds the limits.
+
+    Parameters
+    ----------
+    max_entries : int (optional)
+        Maximum total number of cached values.
+    max_bytes : int (optional)
+        Maximum total approximate size of cached values in bytes.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._order = OrderedDict()
+
+    def __len__(self):
+        return len(self._order)
+
+    def touch(self, cache, key):
+        if (cache, key) in self._order:
+            self._order[(cache, key)] = self._order.pop((cache, key))
+
+    def add(self, cache, key, size):
+        self._order[(cache, key)] = None
+        self.nbytes += size
+        self.enforce()
+
+    def remove(self, cache, key, size):
+        if (cache, key) in self._order:
+            del self._order[(cache, key)]
+            self.nbytes -= size
+
+    def enforce(self):
+        while self._order and self._exceeded():
+            cache, key = next(iter(self._order))
+            cache.evict(key)
+            cache.evictions += 1
+
+    def _exceeded(self):
+        return ((self.max_entries is not None and len(self._order) > self.max_entries) or
+            (self.max_bytes is not None and self.nbytes > self.max_bytes))
+
+
+class MemoCache(object):
+
+    """
+    Least recently used cache of the values of a memoized expression.
+
+    Entries are keyed by ``(names, hashes)`` pairs, where ``names`` is a tuple of the
+    names of the dependencies the expression read, in the order it read them, and
+    ``hashes`` are their hashes. The distinct ``names`` tuples are tracked separately
+    so that a lookup is a single dict probe per sequence of dependencies, and so are
+    the leading parts of the keys, so that a key can be matched one dependency at a
+    time (see :meth:`match`).
+
+    Parameters
+    ----------
+    max_entries : int (optional)
+        Maximum number of cached values.
+    max_bytes : int (optional)
+        Maximum total approximate size of cached values in bytes (see :func:`sizeof`).
+    budget : :class:`CacheBudget` (optional)
+        Shared limits this cache is subject to in addition to its own.
+    store : :class:`DiskStore` (optional)
+        Persistent store consulted on cache misses and updated with new values.
+    namespace : string (optional)
+        Namespace of the cached values in the persistent store.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, budget=None, store=None,
+            namespace=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.store = store
+        self.namespace = namespace
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._signatures = {}
+        self._prefixes = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        return self._entries.keys()
+
+    def signatures(self):
+        return self._signatures.keys()
+
+    def match(self, names, hashes):
+        """
+        Check whether the hashes of the first dependencies of a sequence are those of
+        any of the cached entries with that sequence of dependencies.
+        """
+        if not hashes:
+            return names in self._signatures
+        return (names, tuple(hashes)) in self._prefixes
+
+    def get(self, key):
+        """
+        Retrieve a cached value and mark it as the most recently used one. Raises
+        `KeyError` if the key is not in the cache.
+        """
+        value, size = self._entries.pop(key)
+        self._entries[key] = value, size
+        if self.budget is not None:
+            self.budget.touch(self, key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Store a value in the cache and evict the least recently used entries if any
+        of the limits are exceeded.
+        """
+        if key in self._entries:
+            self.evict(key)
+        size = sizeof(value) if self.max_bytes is not None or (
+            self.budget is not None and self.budget.max_bytes is not None) else 0
+        self._entries[key] = value, size
+        self._index(key, 1)
+        self.nbytes += size
+        while self._entries and self._exceeded():
+            self.evict(next(iter(self._entries)))
+            self.evictions += 1
+        if key in self._entries and self.budget is not None:
+            self.budget.add(self, key, size)
+
+    def evict(self, key):
+        """
+        Remove an entry from the cache.
+        """
+        _, size = self._entries.pop(key)
+        self._index(key, -1)
+        self.nbytes -= size
+        if self.budget is not None:
+            self.budget.remove(self, key, size)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for key in self._entries.keys():
+            self.evict(key)
+
+    def _index(self, key, count):
+        names, hashes = key
+        _count(self._signatures, names, count)
+        for i in xrange(1, len(names)):
+            _count(self._prefixes, (names, hashes[:i]), count)
+
+    def _exceeded(self):
+        return ((self.max_entries is not None and len(self._entries) > self.max_entries) or
+            (self.max_bytes is not None and self.nbytes > self.max_bytes))
+
+
+class DiskStore(object):
+
+    """
+    Persistent store for values of memoized expressions backed by a directory.
+
+    Values are saved with ``joblib.dump()``, so numpy arrays (including the ones
+    held by pandas objects) are written as raw buffers and can be loaded back
+    memory-mapped. Each namespace (a memoized expression) gets a subdirectory that
+    holds one entry per key along with one file per dependency name tuple seen so
+    far, so that a fresh process knows which keys to look up, and an empty marker
+    file per leading part of the keys (see :meth:`MemoCache.match`). Entries and name
+    tuples are written to temporary files first and then renamed, so concurrent
+    readers never see partially written ones, and processes sharing a directory
+    never overwrite each other's.
+
+    Parameters
+    ----------
+    path : string
+        Root directory of the store; created if it does not exist.
+    mmap_mode : string or `None` (optional, default: ``'r'``)
+        Memory-mapping mode passed to ``joblib.load()`` (`None` to load in memory).
+    compress : int (optional, default: 0)
+        Compression level passed to ``joblib.dump()``; compressed values cannot be
+        memory-mapped.
+
+    Examples
+    --------
+    >>> from translucent.reactive import Context
+    >>> rc = Context()
+    >>> rc.new_value(a=1)
+    >>> b = rc.new_expression('b', lambda env: env.a)
+    >>> rc.memoize('b', store=DiskStore('/tmp/translucent-cache'))
+    """
+
+    stable = True
+
+    def __init__(self, path, mmap_mode='r', compress=0):
+        self.path = os.path.abspath(path)
+        self.mmap_mode = mmap_mode
+        self.compress = compress
+        self._signatures = {}
+        _makedirs(self.path)
+
+    def signatures(self, namespace):
+        """
+        Return the list of dependency name tuples stored for a namespace (including
+        the ones stored by other processes in the meantime).
+        """
+        known = self._signatures.setdefault(namespace, {})
+        path = self._signatures_path(namespace)
+        try:
+            filenames = os.listdir(path)
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            if filename not in known and not filename.startswith('tmp'):
+                try:
+                    with open(os.path.join(path, filename), 'rb') as f:
+                        known[filename] = pickle.load(f)
+                except (IOError, EOFError, pickle.UnpicklingError):
+                    pass
+        return sorted(known.values())
+
+    def match(self, namespace, names, hashes):
+        """
+        Check whether the hashes of the first dependencies of a sequence are those of
+        any of the entries of a namespace (see :meth:`MemoCache.match`).
+        """
+        if not hashes:
+            return os.path.exists(self._signature_path(namespace, names))
+        return os.path.exists(self._prefix_path(namespace, names, hashes))
+
+    def get(self, namespace, key):
+        """
+        Load a value from the store. Raises `KeyError` if it is not there.
+        """
+        filename = os.path.join(self._entry_path(namespace, key), 'value.pkl')
+        if not os.path.exists(filename):
+            raise KeyError(key)
+        return joblib.load(filename, mmap_mode=self.mmap_mode)
+
+    def put(self, namespace, key, value):
+        """
+        Save a value to the store under the given namespace and key. Values that
+        cannot be saved (e.g. ones that cannot be pickled) are skipped.
+        """
+        path = self._entry_path(namespace, key)
+        if not os.path.exists(path):
+            _makedirs(os.path.dirname(path))
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+            try:
+                joblib.dump(value, os.path.join(tmp, 'value.pkl'), compress=self.compress)
+                os.rename(tmp, path)
+            except Exception:
+                shutil.rmtree(tmp, ignore_errors=True)
+                if not os.path.exists(path):
+                    return
+        names, hashes = key
+        for i in xrange(1, len(names)):
+            path = self._prefix_path(namespace, names, hashes[:i])
+            if not os.path.exists(path):
+                _makedirs(os.path.dirname(path))
+                open(path, 'a').close()
+        path = self._signature_path(namespace, names)
+        if not os.path.exists(path):
+            _makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(names, f, 2)
+            os.rename(tmp, path)
+
+    def clear(self, namespace=None):
+        """
+        Remove all entries of a namespace, or of the whole store.
+        """
+        if namespace is None:
+            self._signatures = {}
+            path = self.path
+        else:
+            self._signatures.pop(namespace, None)
+            path = self._namespace_path(namespace)
+        shutil.rmtree(path, ignore_errors=True)
+        _makedirs(self.path)
+
+    def _namespace_path(self, namespace):
+        return os.path.join(self.path, _digest([namespace]))
+
+    def _signatures_path(self, namespace):
+        return os.path.join(self._namespace_path(namespace), 'signatures')
+
+    def _signature_path(self, namespace, names):
+        return os.path.join(self._signatures_path(namespace), _digest(names))
+
+    def _entry_path(self, namespace, key):
+        digest = _digest(key[0] + key[1])
+        return os.path.join(self._namespace_path(namespace), digest[:2], digest)
+
+    def _prefix_path(self, namespace, names, hashes):
+        digest = _digest((len(names),) + names + tuple(hashes))
+        return os.path.join(self._namespace_path(namespace), 'prefixes', digest)
+
+
+class SharedStore(object):
+
+    """
+    In-memory store for values of pure memoized expressions shared by all reactive
+    contexts of a process (e.g. the contexts of all sessions of an app).
+
+    Unlike :class:`DiskStore`, values are not copied, and the dependencies whose
+    hashes the contexts already compute as digests (e.g. numpy arrays and pandas
+    objects) are keyed by these digests rather than hashed again; other dependencies
+    are keyed by :func:`stable_hash`, since builtin hashes of different values can
+    be equal. Values are only shared between expressions whose name and function
+    key are the same (see :func:`func_key`), which is why the expressions backed by
+    this store must be pure: their value must depend on nothing but the reactive
+    objects they read.
+
+    Parameters
+    ----------
+    max_entries : int (optional)
+        Maximum total number of stored values.
+    max_bytes : int (optional)
+        Maximum total approximate size of stored values in bytes (see :func:`sizeof`).
+    """
+
+    stable = False
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.budget = CacheBudget(max_entries, max_bytes)
+        self._caches = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.budget)
+
+    def signatures(self, namespace):
+        """
+        Return the list of dependency name tuples stored for a namespace.
+        """
+        with self._lock:
+            cache = self._caches.get(namespace)
+            return cache.signatures() if cache is not None else []
+
+    def match(self, namespace, names, hashes):
+        """
+        Check whether the hashes of the first dependencies of a sequence are those of
+        any of the values of a namespace (see :meth:`MemoCache.match`).
+        """
+        with self._lock:
+            cache = self._caches.get(namespace)
+            return cache is not None and cache.match(names, hashes)
+
+    def get(self, namespace, key):
+        """
+        Retrieve a value from the store. Raises `KeyError` if it is not there.
+        """
+        with self._lock:
+            if namespace not in self._caches:
+                raise KeyError(key)
+            return self._caches[namespace].get(key)
+
+    def put(self, namespace, key, value):
+        """
+        Save a value to the store under the given namespace and key, evicting the
+        least recently used values if any of the limits are exceeded.
+        """
+        with self._lock:
+            if namespace not in self._caches:
+                self._caches[namespace] = MemoCache(budget=self.budget)
+            self._caches[namespace].put(key, value)
+
+    def set_limits(self, max_entries=None, max_bytes=None):
+        """
+        Change the limits of the store (`None` for no limit), evicting the least
+        recently used values if they are exceeded. The sizes of values are only
+        measured while a byte limit is set.
+        """
+        with self._lock:
+            self.budget.max_entries = max_entries
+            self.budget.max_bytes = max_bytes
+            self.budget.enforce()
+
+    def clear(self, namespace=None):
+        """
+        Remove all entries of a namespace, or of the whole store.
+        """
+        with self._lock:
+            namespaces = self._caches.keys() if namespace is None else [namespace]
+            for namespace in namespaces:
+                if namespace in self._caches:
+                    self._caches.pop(namespace).clear()
+
+
+#: The process-wide :class:`SharedStore` backing pure memoized expressions; holds up
+#: to 10000 values taking up to 256 MB by default (see :meth:`SharedStore.set_limits`).
+shared_store = SharedStore(max_entries=10000, max_bytes=256 * 2 ** 20)
+
+
+def _count(counts, key, count):
+    count += counts.get(key, 0)
+    if count:
+        counts[key] = count
+    else:
+        del counts[key]
+
+
+def _digest(parts):
+    md5 = hashlib.md5()
+    for part in parts:
+        md5.update(unicode(part).encode('utf-8') + '\0')
+    return md5.hexdigest()
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
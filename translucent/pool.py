@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ('ProcessPool', 'ProcessFuture')
+
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+
+import joblib
+
+from .memo import sizeof
+from .tracking import _is_pandas
+
+try:
+    from gevent.socket import wait_read
+    from gevent.select import select
+except ImportError:
+    wait_read = None
+    from select import select
+
+
+def _default_tmpdir():
+    # /dev/shm is backed by memory, so memory-mapped files in it are shared memory
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _is_array(value):
+    return _is_pandas(value) or (type(value).__module__ == 'numpy' and hasattr(value, 'dtype'))
+
+
+class _Shared(object):
+
+    """
+    Placeholder for a large numpy or pandas value passed between processes through a
+    memory-mapped file rather than a pipe.
+    """
+
+    __slots__ = ('filename',)
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        return joblib.load(self.filename, mmap_mode='r')
+
+
+def _share(value, tmpdir, max_nbytes):
+    if max_nbytes is None or not _is_array(value) or sizeof(value) < max_nbytes:
+        return value
+    fd, filename = tempfile.mkstemp(suffix='.pkl', dir=tmpdir)
+    os.close(fd)
+    joblib.dump(value, filename)
+    return _Shared(filename)
+
+
+def _unshare(value):
+    return value.load() if isinstance(value, _Shared) else value
+
+
+def _work(tasks, results):
+    # main loop of a worker process
+    while True:
+        try:
+            task = tasks.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args, kwargs, tmpdir, max_nbytes = task
+        try:
+            args = [_unshare(arg) for arg in args]
+            kwargs = dict((k, _unshare(v)) for k, v in kwargs.iteritems())
+            result = True, _share(func(*args, **kwargs), tmpdir, max_nbytes)
+        except Exception as e:
+            result = False, (e, traceback.format_exc())
+        try:
+            results.send(result)
+        except Exception as e:
+            results.send((False, (Exception('cannot send the result: %r' % e), '')))
+
+
+class ProcessFuture(object):
+
+    """
+    Result of a function submitted to a :class:`ProcessPool`.
+
+    Waiting for the result only blocks the calling greenlet if gevent is installed,
+    so a reactive expression returning a process future lets the other greenlets of
+    the process (e.g. other sessions) run in the meantime.
+    """
+
+    def __init__(self, pool, func, args, kwargs):
+        self._pool = pool
+        self._task = func, args, kwargs
+        self._worker = None
+        self._files = []
+        self._done = False
+        self._value = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def ready(self):
+        """
+        Return whether the result has been received.
+        """
+        return self._done
+
+    def get(self):
+        """
+        Wait for the result and return it, or raise the exception raised by the
+        function in the worker process.
+        """
+        with self._lock:
+            while not self._done:
+                if self._worker is None:
+                    # queued behind other tasks; wait until a worker is free
+                    self._pool._wait_running()
+                else:
+                    self._receive()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def _start(self, worker):
+        pool = self._pool
+        func, args, kwargs = self._task
+        args = [self._share(arg) for arg in args]
+        kwargs = dict((k, self._share(v)) for k, v in kwargs.iteritems())
+        self._task = None
+        self._worker = worker
+        try:
+            worker[1].send((func, args, kwargs, pool._tmpdir, pool.max_nbytes))
+        except Exception as e:
+            # e.g. the function is not picklable; the worker is still usable
+            self._finish(None, e)
+            pool._release(self)
+
+    def _collect(self):
+        # receive the result on behalf of whoever waits for it (if anyone)
+        with self._lock:
+            if not self._done and self._worker is not None:
+                self._receive()
+
+    def _share(self, value):
+        value = _share(value, self._pool._tmpdir, self._pool.max_nbytes)
+        if isinstance(value, _Shared):
+            self._files.append(value.filename)
+        return value
+
+    def _receive(self):
+        process, tasks, results = self._worker
+        try:
+            if wait_read is not None:
+                wait_read(results.fileno())
+            ok, result = results.recv()
+        except (EOFError, IOError) as e:
+            ok, result = False, (Exception('worker process %d died: %r' % (process.pid, e)), '')
+            process = None
+        if ok:
+            if isinstance(result, _Shared):
+                # the mapping outlives the file
+                self._files.append(result.filename)
+                result = result.load()
+            self._finish(result, None)
+        else:
+            result[0].remote_traceback = result[1]
+            self._finish(None, result[0])
+        self._pool._release(self, alive=process is not None)
+
+    def _finish(self, value, error):
+        for filename in self._files:
+            os.remove(filename)
+        self._files = []
+        self._value = value
+        self._error = error
+        self._done = True
+
+
+class ProcessPool(object):
+
+    """
+    Pool of worker processes for CPU-heavy reactive expressions.
+
+    Functions submitted to the pool run in worker processes (started on demand, up
+    to `processes` at a time) and return :class:`ProcessFuture` objects, so an
+    expression returning ``pool.submit(...)`` is evaluated concurrently with the
+    rest of the context (see :class:`translucent.reactive.Expression`). Submitted
+    functions and their arguments have to be picklable.
+
+    Numpy arrays and pandas objects of at least `max_nbytes` bytes passed as
+    arguments or returned as results are not pickled through a pipe but dumped to
+    memory-mapped files in `tmpdir` (``/dev/shm``, i.e. shared memory, if available)
+    and loaded read-only by the other side without copying.
+
+    Parameters
+    ----------
+    processes : int (optional)
+        Maximum number of worker processes, defaults to the number of CPUs.
+    max_nbytes : int or `None` (optional, default: 1 MB)
+        Size threshold above which arrays are passed through shared memory (`None`
+        to always pickle them).
+    tmpdir : string (optional)
+        Directory for memory-mapped files.
+
+    Examples
+    --------
+    >>> pool = ProcessPool(processes=4)
+    >>> rc.new_expression('model', pool.expression(fit_model, 'data', 'params'))
+    """
+
+    def __init__(self, processes=None, max_nbytes=2 ** 20, tmpdir=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_nbytes = max_nbytes
+        self._tmpdir = tempfile.mkdtemp(prefix='translucent-', dir=tmpdir or _default_tmpdir())
+        self._workers = []
+        self._idle = []
+        self._queue = deque()
+        self._running = []
+        self._lock = threading.RLock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run ``func(*args, **kwargs)`` in a worker process and return a
+        :class:`ProcessFuture`.
+        """
+        if self._tmpdir is None:
+            raise Exception('process pool is closed')
+        future = ProcessFuture(self, func, args, kwargs)
+        with self._lock:
+            self._queue.append(future)
+            self._dispatch()
+        return future
+
+    def expression(self, func, *names):
+        """
+        Return a reactive expression function that reads the given reactive objects
+        and submits ``func`` to the pool with their values as arguments.
+        """
+        def submit(env):
+            return self.submit(func, *[env[name] for name in names])
+        submit.__name__ = getattr(func, '__name__', submit.__name__)
+        return submit
+
+    def close(self):
+        """
+        Stop the worker processes and remove the temporary files.
+        """
+        with self._lock:
+            for process, tasks, results in self._workers:
+                try:
+                    tasks.send(None)
+                except IOError:
+                    pass
+                tasks.close()
+                results.close()
+            for process, tasks, results in self._workers:
+                process.join()
+            self._workers, self._idle = [], []
+            if self._tmpdir is not None:
+                shutil.rmtree(self._tmpdir, ignore_errors=True)
+                self._tmpdir = None
+
+    def __del__(self):
+        if getattr(self, '_tmpdir', None) is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def _dispatch(self):
+        while self._queue:
+            if not self._idle:
+                if len(self._workers) >= self.processes:
+                    return
+                self._start_worker()
+            future = self._queue.popleft()
+            self._running.append(future)
+            future._start(self._idle.pop())
+
+    def _start_worker(self):
+        # one-way pipes are plain blocking file descriptors even if gevent has
+        # patched the socket module
+        tasks_reader, tasks = multiprocessing.Pipe(duplex=False)
+        results, results_writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_work, args=(tasks_reader, results_writer))
+        process.daemon = True
+        process.start()
+        tasks_reader.close()
+        results_writer.close()
+        worker = process, tasks, results
+        self._workers.append(worker)
+        self._idle.append(worker)
+
+    def _wait_running(self):
+        # wait until any of the running tasks is done, which starts the next queued one
+        with self._lock:
+            running = list(self._running)
+            if not running:
+                self._dispatch()
+                return
+        # the timeout covers tasks that are started elsewhere in the meantime (e.g.
+        # in place of a worker that died)
+        ready = select([future._worker[2] for future in running], [], [], 0.1)[0]
+        for future in running:
+            if future._worker is not None and future._worker[2] in ready:
+                future._collect()
+
+    def _release(self, future, alive=True):
+        with self._lock:
+            self._running.remove(future)
+            if alive:
+                self._idle.append(future._worker)
+            else:
+                self._workers.remove(future._worker)
+            self._dispatch()
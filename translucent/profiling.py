@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ('Profiler', 'Stats', 'TraceRecorder', 'Graph')
+
+import os
+import json
+import thread
+from collections import defaultdict, deque
+
+from .memo import sizeof
+
+_SPANS = frozenset(['flush', 'run', 'set_value', 'cache_lookup', 'wait'])
+
+
+class Stats(list):
+
+    """
+    Table of per-node profiling statistics of a reactive context, as returned by
+    :meth:`translucent.reactive.Context.stats`.
+
+    Each row is a dict with the following keys:
+
+    - ``name``, ``kind``: name and type of the reactive object;
+    - ``runs``: number of runs (expressions and observers) or assignments (values);
+    - ``total_time``: cumulative wall time of the runs or assignments in seconds;
+    - ``self_time``: same, excluding the time spent in other nodes and cache lookups;
+    - ``last_time``: wall time of the last run or assignment in seconds;
+    - ``invalidations``: number of times the node was invalidated;
+    - ``hits``, ``misses``: memoization cache hits and misses;
+    - ``size``: approximate size of the current value in bytes.
+
+    Examples
+    --------
+    >>> stats = rc.stats()
+    >>> print stats.sort_by('self_time')[:10]
+    """
+
+    columns = ('name', 'kind', 'runs', 'total_time', 'self_time', 'last_time', 'invalidations',
+        'hits', 'misses', 'size')
+
+    def sort_by(self, column, ascending=False):
+        """
+        Sort the rows in place by a column (in descending order by default) and
+        return the table.
+        """
+        self.sort(key=lambda row: row[column], reverse=not ascending)
+        return self
+
+    def __getslice__(self, i, j):
+        return self.__class__(list.__getslice__(self, i, j))
+
+    def to_dataframe(self):
+        """
+        Convert the table to a pandas DataFrame indexed by node names.
+        """
+        import pandas as pd
+        return pd.DataFrame(list(self), columns=self.columns).set_index('name')
+
+    def __str__(self):
+        header = ('name', 'kind', 'runs', 'total, ms', 'self, ms', 'last, ms', 'inval',
+            'hits', 'misses', 'size')
+        rows = [header] + [(row['name'], row['kind'], str(row['runs']),
+            '%.3f' % (row['total_time'] * 1e3), '%.3f' % (row['self_time'] * 1e3),
+            '%.3f' % (row['last_time'] * 1e3), str(row['invalidations']), str(row['hits']),
+            str(row['misses']), str(row['size'])) for row in self]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        return '\n'.join(' '.join(cell.ljust(width) if i < 2 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))) for row in rows)
+
+
+class Profiler(object):
+
+    """
+    Trace event listener that accumulates per-node counters (see
+    :meth:`translucent.reactive.Context.start_profile`).
+
+    Self time is derived from the nesting of spans: the time of the spans directly
+    nested in a span is subtracted from its duration. The self times of the nodes
+    run during the last top-level flush are kept in `last_flush`.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(lambda: {'runs': 0, 'total_time': 0., 'self_time': 0.,
+            'last_time': 0., 'invalidations': 0, 'hits': 0, 'misses': 0})
+        self.last_flush = {}
+        self._nested = defaultdict(float)
+        self._flush_runs = defaultdict(float)
+
+    def __call__(self, event):
+        if event.kind in _SPANS:
+            nested = self._nested.pop(event.depth + 1, 0.)
+            self._nested[event.depth] += event.duration
+        if event.node is None:
+            if event.kind == 'flush' and event.depth == 0:
+                self.last_flush, self._flush_runs = dict(self._flush_runs), defaultdict(float)
+            return
+        counters = self.counters[event.node.name]
+        if event.kind in ('run', 'set_value'):
+            counters['runs'] += 1
+            counters['total_time'] += event.duration
+            counters['self_time'] += event.duration - nested
+            counters['last_time'] = event.duration
+            if event.kind == 'run':
+                self._flush_runs[event.node.name] += event.duration - nested
+        elif event.kind == 'invalidate':
+            counters['invalidations'] += 1
+        elif event.kind == 'cache_lookup':
+            counters['hits' if event.cache_hit else 'misses'] += 1
+
+    def stats(self, objects):
+        """
+        Build a :class:`Stats` table for the given reactive objects.
+        """
+        table = Stats()
+        for obj in objects:
+            row = {'name': obj.name, 'kind': type(obj).__name__.lower(), 'size': sizeof(obj.value)}
+            row.update(self.counters[obj.name])
+            table.append(row)
+        return table
+
+    def graph(self, objects):
+        """
+        Build a :class:`Graph` snapshot of the given reactive objects.
+        """
+        objects = list(objects)
+        nodes = self.stats(objects)
+        for node, obj in zip(nodes, objects):
+            node.update(invalidated=obj.invalidated, stale=obj.stale, height=obj.height,
+                suspended=obj.suspended)
+        edges = [{'source': parent.name, 'target': obj.name,
+            'time': self.counters[obj.name]['total_time'],
+            'invalidations': self.counters[obj.name]['invalidations']}
+            for obj in objects for parent in obj.parents]
+
+        # longest path by self time through the nodes run during the last flush
+        cost, previous = {}, {}
+        for obj in sorted(objects, key=lambda obj: obj.height):
+            if obj.name not in self.last_flush:
+                continue
+            parents = [parent.name for parent in obj.parents if parent.name in cost]
+            best = max(parents, key=cost.get) if parents else None
+            cost[obj.name] = self.last_flush[obj.name] + cost.get(best, 0.)
+            previous[obj.name] = best
+        path = []
+        name = max(cost, key=cost.get) if cost else None
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return Graph(nodes, edges, path[::-1])
+
+
+class Graph(object):
+
+    """
+    Snapshot of the dependency graph of a reactive context annotated with profiling
+    counters, as returned by :meth:`translucent.reactive.Context.graph`.
+
+    Attributes
+    ----------
+    nodes : :class:`Stats`
+        A row per reactive object with its profiling counters (see :class:`Stats`)
+        and its ``invalidated``, ``stale``, ``suspended`` and ``height`` state.
+    edges : list of dicts
+        A dict per dependency with the names of the ``source`` (parent) and the
+        ``target`` (child) nodes, weighted by the cumulative ``time`` and the number
+        of ``invalidations`` of the target.
+    critical_path : list of strings
+        Names of the nodes along the chain of dependencies that took the longest to
+        run during the last flush (by self time).
+
+    Examples
+    --------
+    >>> rc.start_profile()
+    >>> rc.set_value(a=2)
+    >>> graph = rc.graph()
+    >>> with open('graph.dot', 'w') as f:
+    ...     f.write(graph.to_dot())
+    """
+
+    _shapes = {'value': 'box', 'expression': 'ellipse', 'observer': 'hexagon'}
+
+    def __init__(self, nodes, edges, critical_path):
+        self.nodes = nodes
+        self.edges = edges
+        self.critical_path = critical_path
+
+    def to_json(self, **kwargs):
+        """
+        Serialize the graph to a JSON string; keyword arguments are passed to
+        ``json.dumps()``.
+        """
+        return json.dumps({'nodes': list(self.nodes), 'edges': self.edges,
+            'critical_path': self.critical_path}, **kwargs)
+
+    def to_dot(self):
+        """
+        Render the graph in the Graphviz DOT language. Nodes are shaded and edges are
+        thickened in proportion to the cumulative time of the nodes, invalidated nodes
+        are dashed and the critical path of the last flush is highlighted.
+        """
+        max_time = max([node['total_time'] for node in self.nodes] + [1e-9])
+        on_path = set(zip(self.critical_path, self.critical_path[1:]))
+        lines = ['digraph reactive {']
+        for node in self.nodes:
+            heat = int(255 * (1 - node['total_time'] / max_time))
+            style = 'filled,dashed' if node['invalidated'] or node['stale'] else 'filled'
+            fmt = ('  %s [shape=%s, style="%s", fillcolor="#ff%02x%02x", '
+                'label="%s\\n%.3f ms, %d runs, %d inval"%s];')
+            lines.append(fmt % (json.dumps(node['name']), self._shapes[node['kind']], style,
+                heat, heat, node['name'], node['total_time'] * 1e3, node['runs'],
+                node['invalidations'],
+                ', penwidth=3' if node['name'] in self.critical_path else ''))
+        for edge in self.edges:
+            lines.append('  %s -> %s [penwidth=%.2f%s];' % (json.dumps(edge['source']),
+                json.dumps(edge['target']), 1 + 4 * edge['time'] / max_time,
+                ', color=red' if (edge['source'], edge['target']) in on_path else ''))
+        lines.append('}')
+        return '\n'.join(lines)
+
+
+class TraceRecorder(object):
+
+    """
+    Trace event listener that records events in the Chrome trace event format, which
+    can be loaded in ``chrome://tracing`` or Perfetto (see
+    :meth:`translucent.reactive.Context.start_trace`).
+
+    Spans (flushes, runs, cache lookups and assignments) are recorded as complete
+    events and invalidations as instant events.
+
+    Parameters
+    ----------
+    max_events : int (optional)
+        If set, only the most recent `max_events` events are kept in a ring buffer.
+
+    Examples
+    --------
+    >>> recorder = rc.start_trace(max_events=10000)
+    >>> rc.set_value(a=2)
+    >>> recorder.dump('flush.json')
+    """
+
+    def __init__(self, max_events=None):
+        self.max_events = max_events
+        self._events = deque(maxlen=max_events)
+        self._pid = os.getpid()
+
+    def __call__(self, event):
+        name = event.kind if event.node is None else '%s(%s)' % (event.kind, event.node.name)
+        record = {'name': name, 'cat': event.kind, 'ts': event.start * 1e6,
+            'pid': self._pid, 'tid': thread.get_ident()}
+        if event.kind in _SPANS:
+            record['ph'] = 'X'
+            record['dur'] = event.duration * 1e6
+        else:
+            record['ph'] = 'i'
+            record['s'] = 't'
+        if event.cache_hit is not None:
+            record['args'] = {'cache_hit': event.cache_hit}
+        self._events.append(record)
+
+    def __len__(self):
+        return len(self._events)
+
+    def events(self):
+        """
+        Return the recorded events as a list of trace event dicts.
+        """
+        return list(self._events)
+
+    def clear(self):
+        """
+        Discard the recorded events.
+        """
+        self._events.clear()
+
+    def dump(self, file):
+        """
+        Write the recorded events as trace event JSON to a path or a file-like object.
+        """
+        if not hasattr(file, 'write'):
+            with open(file, 'w') as stream:
+                return self.dump(stream)
+        json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, file)
@@ -1,30 +1,350 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ('Value', 'Expression', 'Observer', 'Context')
+__all__ = ('Value', 'Expression', 'Observer', 'Context', 'Snapshot', 'TraceEvent',
+    'register_hasher', 'register_comparator', 'register_future')
 
 import re
 import sys
+import heapq
+import hashlib
+import thread
+import itertools
+import functools
+import threading
 from contextlib import contextmanager
 from collections import defaultdict
+from timeit import default_timer as _clock
 from joblib import hashing
 
 from .utils import is_string
+from ._compat import OrderedDict
+from .memo import MemoCache, CacheBudget, stable_hash, func_key, shared_store
+from .tracking import mutation_stamp, freeze, IMMUTABLE
+from .profiling import Profiler, TraceRecorder
+
+
+class _TypeRegistry(object):
+
+    """
+    Functions registered by type. A lookup returns the function registered for the
+    closest base class of a given type (or `None`) and is cached per type.
+    """
+
+    __slots__ = ('_funcs', '_cache', '_defaults')
+
+    def __init__(self, defaults):
+        self._funcs = {}
+        self._cache = {}
+        self._defaults = defaults
+
+    def register(self, cls, func):
+        self._funcs[cls] = func
+        self._cache.clear()
+
+    def unregister(self, cls):
+        self._funcs.pop(cls, None)
+        self._cache.clear()
+
+    def lookup(self, cls):
+        try:
+            return self._cache[cls]
+        except KeyError:
+            self._defaults(self._funcs)
+            func = None
+            for base in getattr(cls, '__mro__', (cls,)):
+                if base in self._funcs:
+                    func = self._funcs[base]
+                    break
+            self._cache[cls] = func
+            return func
+
+
+def register_hasher(cls, func):
+    """
+    Register a function that computes content hashes of values of a given type.
+
+    The hasher is used for instances of the type and of its subclasses (unless a
+    more specific hasher is registered) instead of the builtin ``hash()`` function.
+    It may return any hashable object, as long as equal values get equal hashes and
+    different values almost surely get different ones. Hashers for numpy arrays and
+    pandas objects are built in; registering another hasher for these types
+    overrides them.
+
+    A hasher that returns an integer (like ``hash()`` does) is assumed to produce
+    collisions: in cutoff mode, values with equal integer hashes are compared as well
+    (see :func:`register_comparator`), and memo caches key such values by
+    :func:`translucent.memo.stable_hash` instead. Any other hash (e.g. an md5 digest)
+    is trusted to be equal only for equal values.
+
+    Parameters
+    ----------
+    cls : type
+        Type of values to be hashed.
+    func : function
+        The function ``func(value)`` returning the hash of a value.
+
+    Examples
+    --------
+    >>> class Point(object):
+    ...     def __init__(self, x, y):
+    ...         self.x, self.y = x, y
+    >>> register_hasher(Point, lambda p: hash((p.x, p.y)))
+    """
+    _hashers.register(cls, func)
+
+
+def register_comparator(cls, func):
+    """
+    Register a function that checks values of a given type for equality.
+
+    The comparator is used by :meth:`Value.set_value` to decide whether a new value
+    differs from the current one when the new value is an instance of the type or
+    of its subclasses (unless a more specific comparator is registered), instead of
+    the ``!=`` operator. Comparators for numpy arrays and pandas objects are built
+    in; they return early if the types, shapes or dtypes differ and compare the
+    contents otherwise.
+
+    Parameters
+    ----------
+    cls : type
+        Type of values to be compared.
+    func : function
+        The function ``func(old, new)`` returning `True` if the values are equal.
+
+    Examples
+    --------
+    >>> class Point(object):
+    ...     def __init__(self, x, y):
+    ...         self.x, self.y = x, y
+    >>> register_comparator(Point, lambda a, b: (a.x, a.y) == (b.x, b.y))
+    """
+    _comparators.register(cls, func)
+
+
+def _hash_ndarray(x):
+    # md5 of the raw memory buffer; no copy is made unless the array is not C-contiguous
+    import numpy as np
+    if isinstance(x, np.ma.MaskedArray):
+        # the mask is not part of the data buffer (nor of the joblib hash)
+        return '%s:%s' % (_hash_ndarray(x.data), _hash_ndarray(np.ma.getmaskarray(x)))
+    if x.dtype.hasobject:
+        return hashing.hash(x)
+    if not x.flags.c_contiguous:
+        x = x.copy(order='C')
+    md5 = hashlib.md5('%r%r' % (x.dtype, x.shape))
+    if x.dtype.kind in 'mM':
+        # datetimes and timedeltas cannot be exported as buffers, but their int64
+        # views can (the dtype is part of the hash already)
+        x = x.view('i8')
+    try:
+        md5.update(x)
+    except (ValueError, TypeError):
+        # e.g. structured dtypes with datetime fields
+        return hashing.hash(x)
+    return md5.hexdigest()
+
+
+def _hash_pandas(obj):
+    # md5 of the vectorized row hashes along with the labels and dtypes
+    import pandas as pd
+    try:
+        rows = pd.util.hash_pandas_object(obj, index=True)
+    except TypeError:
+        return hashing.hash(obj)
+    if isinstance(obj, pd.DataFrame):
+        meta = (list(obj.columns), list(obj.dtypes), obj.index.names)
+    elif isinstance(obj, pd.Series):
+        meta = (obj.name, obj.dtype, obj.index.names)
+    else:
+        meta = (obj.names, obj.dtype)
+    md5 = hashlib.md5('%s%r' % (type(obj).__name__, meta))
+    md5.update(rows.values)
+    return md5.hexdigest()
+
+
+def _equal_ndarray(a, b):
+    if type(a) is not type(b) or a.shape != b.shape or a.dtype != b.dtype:
+        return False
+    import numpy as np
+    if isinstance(b, np.ma.MaskedArray):
+        # == ignores the masked elements, so the masks and the data are compared apart
+        return _equal_ndarray(np.ma.getmaskarray(a), np.ma.getmaskarray(b)) and \
+            _equal_ndarray(a.data, b.data)
+    if a.dtype.kind in 'fc':
+        return bool(((a == b) | ((a != a) & (b != b))).all())
+    return bool((a == b).all())
+
+
+def _equal_pandas(a, b):
+    if type(a) is not type(b) or a.shape != b.shape:
+        return False
+    if getattr(a, 'name', None) != getattr(b, 'name', None):
+        return False
+    if [axis.names for axis in getattr(a, 'axes', ())] != \
+            [axis.names for axis in getattr(b, 'axes', ())]:
+        return False
+    return a.equals(b)
+
+
+def _default_hashers(hashers):
+    # values of these types may only exist if the modules have already been imported
+    if 'numpy' in sys.modules:
+        import numpy as np
+        hashers.setdefault(np.ndarray, _hash_ndarray)
+    if 'pandas' in sys.modules:
+        import pandas as pd
+        if hasattr(pd.util, 'hash_pandas_object'):
+            for cls in (pd.DataFrame, pd.Series, pd.Index):
+                hashers.setdefault(cls, _hash_pandas)
+
+
+def _default_comparators(comparators):
+    if 'numpy' in sys.modules:
+        import numpy as np
+        comparators.setdefault(np.ndarray, _equal_ndarray)
+    if 'pandas' in sys.modules:
+        import pandas as pd
+        for cls in (pd.DataFrame, pd.Series, pd.Index):
+            comparators.setdefault(cls, _equal_pandas)
+
+
+_hashers = _TypeRegistry(_default_hashers)
+_comparators = _TypeRegistry(_default_comparators)
+
+
+def register_future(cls, func):
+    """
+    Register a type of futures that the functions of reactive expressions can return
+    instead of values (see :class:`Expression`).
+
+    Only values of registered types (and of their subclasses) are treated as futures;
+    gevent greenlets and async results, ``concurrent.futures`` futures and
+    :class:`translucent.pool.ProcessFuture` objects are registered by default.
+
+    Parameters
+    ----------
+    cls : type
+        Type of futures.
+    func : function
+        The function ``func(future)`` waiting for a future and returning its result
+        (or raising its exception).
+
+    Examples
+    --------
+    >>> register_future(Deferred, lambda d: d.wait())
+    """
+    _futures.register(cls, func)
 
 
 def _fast_hash(obj):
     """
     Returns hash of an arbitrary Python object.
 
-    Works for numpy arrays, pandas objects, custom classes and functions. If an
-    object doesn't support hashing natively, use md5-based ``joblib.hashing.hash()``,
-    otherwise use the standard ``hash()`` function for the sake of performance.
+    Works for numpy arrays, pandas objects, custom classes and functions. Hashers
+    registered for the type of the object take precedence (numpy arrays are hashed
+    by reading their memory buffer directly and pandas objects via vectorized row
+    hashing, see :func:`register_hasher`). Otherwise, the standard ``hash()`` function
+    is used for the sake of performance, and if an object doesn't support hashing
+    natively, md5-based ``joblib.hashing.hash()``.
     """
+    hasher = _hashers.lookup(type(obj))
+    if hasher is not None:
+        return hasher(obj)
     try:
         return hash(obj)
     except:
         return hashing.hash(obj)
 
 
+def _is_digest(value_hash):
+    # unlike the builtin hash(), digests are never equal for different values
+    return not isinstance(value_hash, (int, long))
+
+
+def _values_equal(a, b):
+    """
+    Returns `True` if two values are equal, using the comparator registered for
+    the type of the second one or the ``!=`` operator (see :func:`register_comparator`).
+    """
+    if a is b:
+        return True
+    comparator = _comparators.lookup(type(b))
+    if comparator is not None:
+        return comparator(a, b)
+    try:
+        return not (a != b)
+    except:
+        return False
+
+
+def _stable_key_hash(obj):
+    # like the context-local hash, the stable one is cached per version
+    stable = obj._stable
+    if stable is not None and stable[0] == obj.version:
+        return stable[1]
+    try:
+        value_hash = stable_hash(obj.value)
+    except Exception:
+        return None
+    obj._stable = obj.version, value_hash
+    return value_hash
+
+
+def _shared_key_hash(obj):
+    # values shared across contexts are only keyed on digests: builtin hashes collide
+    # (e.g. hash(-1) == hash(-2) and hash(1) == hash(1.0)) and identity-based ones are
+    # only meaningful within the lifetime of an object
+    value_hash = obj.hash
+    if _is_digest(value_hash):
+        return value_hash
+    return _stable_key_hash(obj)
+
+
+def _local_key_hash(obj):
+    # memo keys within a context are collision-free as well, except for values that
+    # cannot be digested, which are keyed by their builtin (e.g. identity-based) hash
+    value_hash = _shared_key_hash(obj)
+    return obj.hash if value_hash is None else value_hash
+
+
+def _store_key_hash(store):
+    return _stable_key_hash if store.stable else _shared_key_hash
+
+
+def _get_result(future):
+    return future.get()
+
+
+def _future_result(future):
+    return future.result()
+
+
+def _default_futures(futures):
+    # futures of these types may only exist if the modules have already been imported
+    if 'gevent' in sys.modules:
+        import gevent
+        from gevent.event import AsyncResult
+        futures.setdefault(gevent.Greenlet, _get_result)
+        futures.setdefault(AsyncResult, _get_result)
+    if 'concurrent.futures' in sys.modules:
+        from concurrent.futures import Future
+        futures.setdefault(Future, _future_result)
+    if 'translucent.pool' in sys.modules:
+        from .pool import ProcessFuture
+        futures.setdefault(ProcessFuture, _get_result)
+
+
+_futures = _TypeRegistry(_default_futures)
+
+
+def _is_future(value):
+    return _futures.lookup(type(value)) is not None
+
+
+def _wait(future):
+    return _futures.lookup(type(future))(future)
+
+
 class UndefinedKey(Exception):
 
     """
@@ -44,10 +364,263 @@ class UndefinedKey(Exception):
         self.name = name
 
 
+def _no_format(value):
+    # used in place of the value formatter while logging is off
+    return None
+
+
+class TraceEvent(object):
+
+    """
+    Structured event emitted by a reactive context to its listeners (see
+    :meth:`Context.add_listener`).
+
+    Spans are emitted once they end, so the events of nested spans always precede
+    the event of the span they are nested in.
+
+    Attributes
+    ----------
+    kind : string
+        One of ``'flush'``, ``'run'`` (an expression or an observer ran),
+        ``'set_value'``, ``'cache_lookup'`` and ``'wait'`` (waiting for the result of
+        a concurrent expression) for spans, or ``'invalidate'``,
+        ``'stale'`` and ``'cutoff'`` (the value of an expression did not change)
+        for instant events.
+    node : :class:`.Value`, :class:`.Expression`, :class:`.Observer` or `None`
+        Reactive object the event relates to (`None` for flushes).
+    start : float
+        Start time as returned by ``timeit.default_timer()``.
+    duration : float
+        Duration of the span in seconds (zero for instant events).
+    depth : int
+        Number of spans the event is nested in.
+    cache_hit : bool or `None`
+        Whether a cache lookup was a hit (`None` for other kinds of events).
+    """
+
+    __slots__ = ('kind', 'node', 'start', 'duration', 'depth', 'cache_hit')
+
+    def __init__(self, kind, node, start, duration, depth, cache_hit=None):
+        self.kind = kind
+        self.node = node
+        self.start = start
+        self.duration = duration
+        self.depth = depth
+        self.cache_hit = cache_hit
+
+    def __repr__(self):
+        return '<TraceEvent %s(%s) %.6fs%s>' % (self.kind,
+            self.node.name if self.node is not None else '', self.duration,
+            '' if self.cache_hit is None else ' hit' if self.cache_hit else ' miss')
+
+
+class _NullBlock(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_BLOCK = _NullBlock()
+
+
+class _Span(object):
+
+    """
+    Block of activity within a reactive context that is logged to the log stream
+    (indenting the messages logged within it) and, if it has a kind, reported as
+    a :class:`TraceEvent` to the listeners once it ends.
+    """
+
+    __slots__ = ('context', 'kind', 'node', 'fmt', 'args', 'start')
+
+    def __init__(self, context, kind, node, fmt, args):
+        self.context = context
+        self.kind = kind
+        self.node = node
+        self.fmt = fmt
+        self.args = args
+
+    def __enter__(self):
+        context = self.context
+        if self.fmt is not None:
+            context.log(self.fmt, *self.args)
+        context._log_indent += 1
+        if self.kind is not None:
+            context._span_depth += 1
+            self.start = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        context = self.context
+        context._log_indent -= 1
+        if self.kind is not None:
+            context._span_depth -= 1
+            if context._listeners:
+                context._emit(self.kind, self.node, self.start)
+        return False
+
+
+class _ContextLock(object):
+
+    """
+    Re-entrant lock of a thread-safe context that keeps track of the thread holding
+    it, so that reads from other threads can tell they are outside of any evaluation.
+    """
+
+    __slots__ = ('_lock', '_count', 'owner')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._count = 0
+        self.owner = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._count += 1
+        self.owner = thread.get_ident()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._count -= 1
+        if not self._count:
+            self.owner = None
+        self._lock.release()
+        return False
+
+
+class _Deferred(BaseException):
+
+    """
+    Raised to abort the evaluation of a reactive expression that is nested too
+    deeply within evaluations of other expressions; the outermost evaluation then
+    evaluates the expression itself and retries (see ``Context._trampoline()``).
+
+    Derives from `BaseException` so that it passes through generic exception
+    handlers in the functions of expressions and observers. A function that catches
+    it anyway (e.g. with a bare ``except:``) and returns is detected, and the abort
+    is raised again once it returns (see ``_Callable.try_run()``).
+    """
+
+    def __init__(self, obj):
+        super(_Deferred, self).__init__()
+        self.obj = obj
+
+
+class _FlushQueue(object):
+
+    """
+    Priority queue of observers scheduled to run on the next flush.
+
+    Observers are ordered by their height in the dependency graph (observers that
+    are closer to the reactive values they depend on run first) and then by the
+    order in which they were scheduled. Membership is tracked in a set so that an
+    observer pending in the queue is never scheduled twice.
+    """
+
+    __slots__ = ('_heap', '_members', '_counter')
+
+    def __init__(self):
+        self._heap = []
+        self._members = set()
+        self._counter = itertools.count()
+
+    def push(self, obj):
+        if obj in self._members:
+            return False
+        self._members.add(obj)
+        heapq.heappush(self._heap, (obj.height, next(self._counter), obj))
+        return True
+
+    def pop(self):
+        obj = heapq.heappop(self._heap)[-1]
+        self._members.discard(obj)
+        return obj
+
+    def __contains__(self, obj):
+        return obj in self._members
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class _OrderedSet(object):
+
+    """
+    Insertion-ordered set with constant time insertions, removals and membership
+    tests, used for the edges of the dependency graph.
+
+    Small sets are plain lists (scanning a few items is as fast as a dict lookup and
+    takes a fraction of the memory); larger ones also keep an index of positions.
+    Removed items leave holes in the list that are skipped when iterating and
+    compacted away once they make up the most of it. Items added while the set is
+    being iterated over are visited as well, like with a list.
+    """
+
+    __slots__ = ('_items', '_index')
+
+    _hole = object()
+    _small = 8
+
+    def __init__(self, items=()):
+        self._items = []
+        self._index = None
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item in self:
+            return
+        if self._index is None and len(self._items) >= self._small:
+            self._compact()
+            self._index = dict((item, i) for i, item in enumerate(self._items))
+        if self._index is not None:
+            self._index[item] = len(self._items)
+        self._items.append(item)
+
+    def discard(self, item):
+        if self._index is None:
+            if item not in self._items:
+                return
+            i = self._items.index(item)
+        else:
+            i = self._index.pop(item, None)
+            if i is None:
+                return
+        self._items[i] = self._hole
+        if len(self._items) > 2 * len(self) + self._small:
+            self._compact()
+            self._index = dict((item, i) for i, item in enumerate(self._items))
+
+    def _compact(self):
+        self._items = [item for item in self._items if item is not self._hole]
+
+    def __contains__(self, item):
+        if self._index is None:
+            return item in self._items
+        return item in self._index
+
+    def __len__(self):
+        if self._index is None:
+            return len(self._items) - self._items.count(self._hole)
+        return len(self._index)
+
+    def __iter__(self):
+        hole = self._hole
+        for item in self._items:
+            if item is not hole:
+                yield item
+
+
 class _Object(object):
 
-    __slots__ = ('name', 'value', 'hash', 'func', 'invalidated', 'parents', 'children',
-        'context', 'exec_count', 'suspended')
+    __slots__ = ('name', 'value', 'version', 'verified', '_hash', '_hash_version', '_stamp',
+        'func', 'frozen', 'invalidated', 'stale', 'parents', 'children', 'context', 'exec_count',
+        'suspended', 'height', '_written', '_until', '_history', '_stable')
 
     def __init__(self, name):
         name_regex = r'^((_[_]+)|[a-zA-Z])[_a-zA-Z0-9]*$'
@@ -55,32 +628,208 @@ class _Object(object):
             raise Exception('invalid reactive object name: "%s"' % name)
         self.name = name
         self.value = None
-        self.hash = _fast_hash(self.value)
+        self.version = 0
+        self.verified = 0
+        self._hash = None
+        self._hash_version = -1
+        self._stamp = None
         self.func = None
+        self.frozen = False
         self.invalidated = True
-        self.parents = []
-        self.children = []
+        self.stale = False
+        self.parents = ()
+        self.children = ()
         self.context = None
         self.exec_count = 0
         self.suspended = False
+        self.height = 0
+        self._written = 0
+        self._until = None
+        self._history = None
+        self._stable = None
+
+    @property
+    def hash(self):
+        """
+        Content hash of the current value.
+
+        The hash is computed lazily and cached per version, so an object is hashed
+        at most once per write, and only if something (cutoff mode, memoization or,
+        in safe mode, a read of the value) actually needs its hash; changes are
+        otherwise detected by comparing versions.
+        """
+        if self._hash_version != self.version:
+            self._stamp = mutation_stamp(self.value)
+            self._hash = _fast_hash(self.value)
+            self._hash_version = self.version
+        return self._hash
+
+    @hash.setter
+    def hash(self, value):
+        self._stamp = mutation_stamp(self.value)
+        self._hash = value
+        self._hash_version = self.version
+
+    def _unmodified(self):
+        """
+        Check whether the value is known not to have been modified in place since
+        it was last hashed, without hashing it (see
+        :func:`translucent.tracking.mutation_stamp`).
+        """
+        if self.frozen:
+            return True
+        stamp = self._stamp
+        if stamp is None or self._hash_version != self.version:
+            return False
+        if stamp is IMMUTABLE and not hasattr(self.value, 'flags'):
+            # numpy arrays can be made writeable again, so their flags are re-checked
+            return True
+        return stamp == mutation_stamp(self.value)
+
+    def _watch(self):
+        """
+        Hash the value the first time it is handed out in safe mode, so that its
+        modifications in place can be detected from then on. A value nothing has
+        read yet has no readers that could be out of date, so it is not hashed.
+        """
+        if not self.frozen and self._hash_version != self.version:
+            self.hash = _fast_hash(self.value)
+
+    def _modified(self):
+        """
+        Check whether the value has been modified in place since it was handed out
+        (safe mode), re-hashing it only if its mutation stamp cannot tell.
+        """
+        if self._hash_version != self.version or self._unmodified():
+            return False
+        if _fast_hash(self.value) != self._hash:
+            return True
+        self._stamp = mutation_stamp(self.value)
+        return False
 
     def invalidate(self):
         """
         Mark a reactive object as invalidated.
+
+        If the context runs in cutoff mode, the invalidation is not propagated
+        transitively; instead, the descendants of the object are only marked as
+        stale and are re-checked against the versions of their parents when pulled
+        (descendants that are currently running have already read the outdated
+        value and are invalidated right away).
+
+        The descendants are traversed depth-first with an explicit worklist rather
+        than recursively, so the depth of the graph is not limited by the depth of
+        the Python stack.
         """
-        self.invalidated = True
-        if self.is_observer() and not self.suspended:
-            if self not in self.context._flush_queue:
-                self.context.log('flush_queue.append(%s)', self.name)
-                self.context._flush_queue.append(self)
+        context = self.context
+        worklist = [self]
+        while worklist:
+            obj = worklist.pop()
+            context.log('%s.invalidate()', obj.name)
+            if context._listeners:
+                context._emit('invalidate', obj)
+            obj.invalidated = True
+            if obj._until is None:
+                obj._until = context._epoch
+            obj._schedule()
+            if context.cutoff:
+                for child in obj.children:
+                    if context._is_running(child):
+                        worklist.append(child)
+                    else:
+                        child._mark_stale()
+            else:
+                children, obj.children = obj.children, ()
+                worklist.extend(reversed(list(children)))
+                for parent in obj.parents:
+                    if parent.children:
+                        parent.children.discard(obj)
+
+    def _mark_stale(self):
+        worklist = [self]
+        while worklist:
+            obj = worklist.pop()
+            if obj.stale or obj.invalidated:
+                continue
+            obj.context.log('%s.mark_stale()', obj.name)
+            if obj.context._listeners:
+                obj.context._emit('stale', obj)
+            obj.stale = True
+            if obj._until is None:
+                obj._until = obj.context._epoch
+            obj._schedule()
+            worklist.extend(reversed(list(obj.children)))
+
+    def _schedule(self):
+        if self.is_observer():
+            self.context._dirty.add(self)
+            if not self.suspended:
+                if self.context._flush_queue.push(self):
+                    self.context.log('flush_queue.push(%s)', self.name)
+                else:
+                    self.context.log('%s in flush_queue', self.name)
+
+    def _update(self):
+        """
+        Bring a stale object up to date by pulling its parents (cutoff mode). If any
+        of the parents has a newer version than the one this object was last verified
+        against, the object gets invalidated.
+        """
+        if self.stale and not self.invalidated:
+            with self.context.log_block('%s.update()', self.name):
+                for parent in list(self.parents):
+                    if parent.is_expression():
+                        parent.get_value(isolate=True)
+                    if parent.version > self.verified:
+                        self.context.log('%s changed', parent.name)
+                        if self.context._listeners:
+                            self.context._emit('invalidate', self)
+                        self.invalidated = True
+                        break
+                else:
+                    self.verified = self.context._version
+                    if self._until is not None:
+                        # the value is current again, but it was out of date in the
+                        # epochs in between, so it is recorded afresh (see _value_at)
+                        self._assign(self.value)
+        self.stale = False
+
+    def _assign(self, value):
+        context = self.context
+        if self._written < context._epoch:
+            # the overwritten value belongs to a committed state that snapshots can
+            # read; it is kept until no snapshot needs it (see Context._prune). The
+            # epoch is updated before the value, so that concurrent readers never see
+            # a new value with an old epoch.
+            if self._history is None:
+                self._history = []
+                context._touched.append(self)
+            self._history.append((self._written, self._until, self.value))
+            self._written = context._epoch
+        if value is not self.value:
+            self._stamp = None
+        self.value = value
+        self._until = None
+
+    def _value_at(self, epoch):
+        """
+        Return the value of the object as of a committed epoch along with whether it
+        was up to date at the time, or `None` if the object did not exist yet.
+        """
+        until, value, written = self._until, self.value, self._written
+        if written > epoch:
+            for written, until, value in reversed(self._history or ()):
+                if written <= epoch:
+                    break
             else:
-                self.context.log('%s in flush_queue', self.name)
-        with self.context.log_block('%s.invalidate()', self.name):
-            for child in self.children:
-                child.invalidate()
-            for parent in self.parents:
-                parent.children = [child for child in parent.children if child != self]
-        self.children = []
+                return None
+        return value, until is None or until > epoch or self.is_value()
+
+    def _remove_parents(self):
+        for parent in self.parents:
+            if parent.children:
+                parent.children.discard(self)
+        self.parents = ()
 
     def is_value(self):
         return isinstance(self, Value)
@@ -92,22 +841,38 @@ class _Object(object):
         return isinstance(self, Expression)
 
     def add_parent(self, parent):
-        if parent not in self.parents:
-            self.parents.append(parent)
-        if self not in parent.children:
-            parent.children.append(self)
+        # edge containers are only allocated once needed (leaves never need children)
+        if not self.parents:
+            self.parents = _OrderedSet()
+        self.parents.add(parent)
+        if not parent.children:
+            parent.children = _OrderedSet()
+        parent.children.add(self)
+        if parent.height >= self.height:
+            self.height = parent.height + 1
 
 
 class Value(_Object):
 
     """
     Reactive value.
+
+    Parameters
+    ----------
+    name : string
+        Name of the value.
+    value : object
+        Initial value.
+    frozen : bool (optional, default: `False`)
+        Treat the value as immutable (see :meth:`Context.freeze`).
     """
 
-    def __init__(self, name, value):
+    __slots__ = ()
+
+    def __init__(self, name, value, frozen=False):
         super(Value, self).__init__(name)
-        self.value = value
-        self.hash = _fast_hash(value)
+        self.value = freeze(value) if frozen else value
+        self.frozen = frozen
 
     def set_value(self, value):
         """
@@ -115,13 +880,22 @@ class Value(_Object):
         ----------
         value : object
         """
-        with self.context.log_block('%s.set_value(%s)', self.name,
+        with self.context._span('set_value', self, '%s.set_value(%s)', self.name,
                 self.context._fmt_value(value)):
-            new_hash = _fast_hash(value)
-            if self.value != value or (self.context.safe and self.hash != new_hash):
+            if self.frozen:
+                if value is self.value:
+                    self.context.log('%s unchanged (frozen)', self.name)
+                    self.context.flush()
+                    return
+                freeze(value)
+            changed = not _values_equal(self.value, value)
+            if not changed and self.context.safe:
+                # the current value may have been modified in place since it was read
+                changed = self._modified()
+            if changed:
                 self.invalidate()
-            self.value = value
-            self.hash = new_hash
+                self.version = self.context._next_version()
+            self._assign(value)
             self.context.flush()
 
     def get_value(self, isolate=False):
@@ -132,77 +906,299 @@ class Value(_Object):
         """
         if not isolate:
             self.invalidated = False
+        if self.context.safe:
+            self._watch()
         return self.value
 
 
 class _Callable(_Object):
 
+    __slots__ = ()
+
     def __init__(self, name, func):
         super(_Callable, self).__init__(name)
         if not callable(func):
             raise Exception('func in expression "%s" must be a callable' % name)
         self.func = func
 
-    def try_run(self, isolate=False):
+    def try_run(self, isolate=False, env=None):
+        # dependencies are recorded afresh on each run, so that edges to objects that
+        # are no longer read (e.g. in a branch not taken) are dropped
+        if not self.context._is_running(self):
+            self._remove_parents()
+        # an environment passed explicitly records dependencies on its own, so the
+        # shared call stack is left alone (see _ObserverEnvironment)
+        stacked = env is None
+        deferred = self.context._deferred
         try:
-            self.context._push_call_stack(self)
+            if stacked:
+                self.context._push_call_stack(self)
+                env = self.context.env
+            else:
+                self.context._running[self] += 1
             self.invalidated = False
-            with self.context.log_block('%s.run()', self.name):
-                self.value = self.func(self.context.env)
-                self.hash = _fast_hash(self.value)
+            self.stale = False
+            with self.context._span('run', self, '%s.run()', self.name):
+                value = self.func(env)
+                if self.context._deferred is not None and \
+                        self.context._deferred is not deferred:
+                    # the function caught the abort of a deferred evaluation (e.g. with
+                    # a bare except) and returned a value computed without it
+                    raise _Deferred(self.context._deferred)
+                self._store(value)
+                self.verified = self.context._version
                 if self.context.safe and self.parents:
                     self.context._check_hash_integrity(self.parents)
         except UndefinedKey as e:
             self.context.log('=> UndefinedKey')
             self.invalidated = True
             raise e
+        except _Deferred:
+            # aborted runs are retried later and are not counted
+            self.invalidated = True
+            self.exec_count -= 1
+            raise
         finally:
-            self.context._pop_call_stack(self)
+            if stacked:
+                self.context._pop_call_stack(self)
+            else:
+                self.context._running[self] -= 1
+                if not self.context._running[self]:
+                    del self.context._running[self]
             self.exec_count += 1
 
+    def _store(self, value, new_hash=None):
+        # only cutoff mode compares the values of consecutive runs
+        if new_hash is None and self.context.cutoff:
+            new_hash = _fast_hash(value)
+        # builtin hashes collide (e.g. hash(-1) == hash(-2)), so the values of equal
+        # builtin hashes are compared as well
+        if self.context.cutoff and new_hash == self.hash and (_is_digest(new_hash) or
+                (type(value) is type(self.value) and _values_equal(self.value, value))):
+            self.context.log('%s unchanged (cutoff)', self.name)
+            if self.context._listeners:
+                self.context._emit('cutoff', self)
+        else:
+            self.version = self.context._next_version()
+        self._assign(value)
+        if new_hash is not None:
+            self.hash = new_hash
+
 
 class Expression(_Callable):
 
     """
     Reactive expression.
+
+    The function of an expression can return a future (a gevent greenlet or async
+    result, a ``concurrent.futures`` future or any other registered type of futures,
+    see :func:`register_future`) instead of a value, in which case the expression
+    only waits for the result once its value is needed. Such expressions
+    are prefetched: at the start of each flush, the out-of-date ones are run up to
+    the point where they return their futures, so that independent slow expressions
+    are evaluated concurrently (see :meth:`Context.prefetch`). The function has to
+    read all of its dependencies before returning the future; the future itself must
+    not access the environment.
+
+    Evaluations nested more than a few dozen expressions deep (e.g. in long chains of
+    expressions) are aborted and retried once the expression they pull has been
+    evaluated on its own, so the functions of expressions may be run more than once
+    per evaluation and should not have side effects.
+
+    Examples
+    --------
+    >>> import gevent
+    >>> e = Expression('e', lambda env: gevent.spawn(query, env.a, env.b))
     """
 
-    __slots__ = ('memoized', '_cache', '_current_cache')
+    __slots__ = ('memoized', 'prefetch', '_cache', '_current_cache', '_future')
 
     def __init__(self, name, func):
         super(Expression, self).__init__(name, func)
         self.memoized = False
-        self._cache = {}
-        self._current_cache = {}
+        self.prefetch = False
+        self._cache = None
+        self._current_cache = None
+        self._future = None
 
     def get_value(self, isolate=False):
-        if self.invalidated or self.context._is_running(self):
-            if self.memoized:
-                env_hash = frozenset((name, obj.hash)
-                    for name, obj in self.context._objects.iteritems()
-                    if not obj.is_observer())
-                for h in self._cache:
-                    if h <= env_hash:
-                        value = self._cache[h]
-                        self.context.log('retrieving value from cache: %s -> %s',
-                            self.name, self.context._fmt_value(value))
-                        self.value = value
-                        for name, _ in h:
-                            self.add_parent(self.context[name])
-                        return self.value
-                self._current_cache = {}
-            self.try_run(isolate=isolate)
-            if self.memoized:
-                key = frozenset(self._current_cache.items())
-                if key not in self._cache:
-                    self.context.log('updating cache: %s -> %s',
-                        self.name, self.context._fmt_value(self.value))
-                    self._cache[key] = self.value
+        context = self.context
+        # evaluations hold the lock of a thread-safe context, so that the reads they
+        # make through the context are recorded as dependencies (see Context._read)
+        with context._locked():
+            if not context._depth:
+                value = context._trampoline(self, isolate)
+                # a flush commits once it is done (see Context.flush)
+                if not context._call_stack and not context._transaction_depth and \
+                        not context._flushing:
+                    context._commit()
+                return value
+            return self._get_value(isolate)
+
+    def _get_value(self, isolate=False):
+        context = self.context
+        if context._depth >= context._max_depth and (self.invalidated or self.stale) and \
+                not context._is_running(self):
+            context._deferred = self
+            raise _Deferred(self)
+        context._depth += 1
+        try:
+            if context.cutoff:
+                self._update()
+            if self.invalidated or context._is_running(self):
+                self._compute(isolate=isolate)
+            if self._future is not None:
+                self._wait()
+        finally:
+            context._depth -= 1
+        if context.safe:
+            self._watch()
         return self.value
 
+    def _compute(self, isolate=False):
+        if self.memoized:
+            context = self.context
+            start = None
+            if context._listeners:
+                # the lookup is a span of its own, so that the expressions evaluated
+                # during the lookup are nested in it rather than next to it
+                start = _clock()
+                context._span_depth += 1
+            try:
+                hit = self._cache_lookup()
+            finally:
+                if start is not None:
+                    context._span_depth -= 1
+            if start is not None:
+                context._emit('cache_lookup', self, start, cache_hit=hit)
+            if hit:
+                return
+            self._current_cache = OrderedDict()
+        self.try_run(isolate=isolate)
+        if self.memoized and self._future is None:
+            self._cache_update()
+
+    def _store(self, value, new_hash=None):
+        if _is_future(value):
+            # the value is stored once the result is needed (see _wait)
+            self.context.log('%s returned a future', self.name)
+            self._future = value
+            if not self.prefetch:
+                self.context.prefetch(self)
+            return
+        self._future = None
+        super(Expression, self)._store(value, new_hash)
+
+    def _start(self):
+        """
+        Run an out-of-date expression up to the point where it returns a future
+        without waiting for the result (used for prefetching).
+        """
+        if self.context.cutoff:
+            self._update()
+        if self.invalidated and self._future is None:
+            self._compute(isolate=True)
+
+    def _wait(self):
+        future = self._future
+        with self.context._span('wait', self, '%s.wait()', self.name):
+            try:
+                value = _wait(future)
+            except BaseException:
+                # the expression is re-run the next time its value is needed
+                self._future = None
+                self.invalidated = True
+                raise
+        if self._future is future:
+            self._future = None
+            _Callable._store(self, value)
+            if self.memoized:
+                self._cache_update()
+
+    def _cache_lookup(self):
+        cache = self._cache
+        for names in cache.signatures():
+            key = self._cache_key(names, match=cache.match)
+            if key is not None and key in cache:
+                self._cache_hit(names, cache.get(key))
+                return True
+        store = cache.store
+        if store is not None:
+            match = functools.partial(store.match, cache.namespace)
+            for names in store.signatures(cache.namespace):
+                key = self._cache_key(names, _store_key_hash(store), match)
+                if key is None:
+                    continue
+                try:
+                    value = store.get(cache.namespace, key)
+                except KeyError:
+                    continue
+                self.context.log('retrieving value from store: %s', self.name)
+                key = self._cache_key(names)
+                if key is not None:
+                    cache.put(key, value)
+                cache.hits += 1
+                self._cache_hit(names, value)
+                return True
+        cache.misses += 1
+        return False
+
+    def _cache_hit(self, names, value):
+        self.context.log('retrieving value from cache: %s -> %s',
+            self.name, self.context._fmt_value(value))
+        self._store(value)
+        self.invalidated = False
+        self.verified = self.context._version
+        self._remove_parents()
+        for name in names:
+            self.add_parent(self.context[name])
+
+    def _cache_update(self):
+        cache = self._cache
+        names = tuple(self._current_cache)
+        key = (names, tuple(self._current_cache.values()))
+        if key not in cache:
+            self.context.log('updating cache: %s -> %s',
+                self.name, self.context._fmt_value(self.value))
+            cache.put(key, self.value)
+            if cache.store is not None:
+                key = self._cache_key(names, _store_key_hash(cache.store))
+                if key is not None:
+                    cache.store.put(cache.namespace, key, self.value)
+
+    def _cache_key(self, names, key_hash=None, match=None):
+        """
+        Build a cache key out of the current hashes of the given dependencies (in the
+        order they were read), or return `None` if no cached entry can match it.
+
+        Dependencies are hashed one at a time. An expression that is out of date is
+        only evaluated if the hashes of the dependencies read before it are those of
+        some cached entry, as told by ``match(names, hashes)``: given the same values,
+        this expression would read it next, so it is never evaluated off the current
+        path (e.g. in a branch that is no longer taken). Without `match`, out-of-date
+        expressions are never evaluated. If `key_hash` is passed, it is used to hash
+        the dependencies instead of their context-local digests.
+        """
+        hashes = []
+        for name in names:
+            obj = self.context._objects.get(name)
+            if obj is None:
+                return None
+            if obj.is_expression() and (obj.invalidated or obj.stale or
+                    obj._future is not None):
+                if self.context._is_running(obj) or match is None or \
+                        not match(names, hashes):
+                    return None
+                obj.get_value(isolate=True)
+            value_hash = (key_hash or _local_key_hash)(obj)
+            if value_hash is None:
+                return None
+            hashes.append(value_hash)
+        return names, tuple(hashes)
+
     def _update_cache(self, name, value):
         if name not in self._current_cache:
-            self._current_cache[name] = _fast_hash(value)
+            self._current_cache[name] = _local_key_hash(self.context[name])
 
 
 class Observer(_Callable):
@@ -223,14 +1219,19 @@ class Observer(_Callable):
         >>> obs = Observer('obs', lambda env: env.x + 1)
     """
 
+    __slots__ = ()
+
     def __init__(self, name, func):
         super(Observer, self).__init__(name, func)
 
-    def run(self):
-        try:
-            self.try_run()
-        except UndefinedKey as e:
-            self.context._register_pending(e.name, self)
+    def run(self, env=None):
+        with self.context._locked():
+            self.context._dirty.discard(self)
+            try:
+                self.try_run(env=env)
+            except UndefinedKey as e:
+                self.context._dirty.add(self)
+                self.context._register_pending(e.name, self)
 
     def suspend(self):
         self.context.log('%s.suspend()', self.name)
@@ -238,6 +1239,8 @@ class Observer(_Callable):
 
     def resume(self, run=False):
         self.context.log('%s.resume()', self.name)
+        if self.context.cutoff and self.suspended and run:
+            self._update()
         if self.suspended and self.invalidated and run:
             self.suspended = False
             self.run()
@@ -276,6 +1279,10 @@ class Environment(object):
     def __contains__(self, key):
         return key in self._context
 
+    def __call__(self, *args, **kwargs):
+        self._context.set_value(*args, **kwargs)
+        return self
+
     def __invert__(self):
         return self._isolate_block()
 
@@ -286,6 +1293,212 @@ class Environment(object):
         self._isolate = False
 
 
+class _ThreadSafeEnvironment(Environment):
+
+    """
+    Environment of a thread-safe context, whose isolation flag (toggled by the
+    ``~env`` and ``env[...]`` blocks) is local to each thread.
+    """
+
+    def __init__(self, context, isolate=False):
+        self.__dict__.update(_context=context, _local=threading.local(),
+            _default_isolate=isolate)
+
+    @property
+    def _isolate(self):
+        return getattr(self._local, 'isolate', self._default_isolate)
+
+    def __setattr__(self, key, value):
+        if key == '_isolate':
+            self._local.isolate = value
+        else:
+            super(_ThreadSafeEnvironment, self).__setattr__(key, value)
+
+
+class _ObserverEnvironment(Environment):
+
+    """
+    Environment of an observer run concurrently with other observers. Dependencies
+    are recorded on the observer directly rather than through the call stack, which
+    is shared, and reads are serialized with a lock, so that an expression is only
+    ever evaluated by one greenlet at a time (and only once if several observers
+    read it).
+    """
+
+    def __init__(self, context, observer, lock, isolate=False):
+        self.__dict__.update(_context=context, _isolate=isolate, _observer=observer,
+            _lock=lock)
+
+    def __getattr__(self, key):
+        with self._lock:
+            return self._context.get_value(key, self._isolate, self._observer)
+
+    def __getitem__(self, key):
+        if key == slice(None, None, None):
+            if not self._isolate:
+                return self.__class__(self._context, self._observer, self._lock, True)
+            return self
+        elif key is Ellipsis:
+            return self._isolate_block()
+        with self._lock:
+            return self._context.get_value(key, self._isolate, self._observer)
+
+    def __setattr__(self, key, value):
+        with self._lock:
+            super(_ObserverEnvironment, self).__setattr__(key, value)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._context.set_value(key, value)
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self._context.set_value(*args, **kwargs)
+        return self
+
+
+class _SnapshotEnvironment(object):
+
+    """
+    Environment passed to the functions of expressions evaluated within a snapshot:
+    all reads go to the snapshot, isolation is a no-op and writes are not allowed.
+    """
+
+    def __init__(self, snapshot):
+        self.__dict__['_snapshot'] = snapshot
+
+    def __getattr__(self, key):
+        return self._snapshot.get_value(key)
+
+    def __getitem__(self, key):
+        if key == slice(None, None, None):
+            return self
+        elif key is Ellipsis:
+            return self._isolate_block()
+        return self._snapshot.get_value(key)
+
+    def __contains__(self, key):
+        return key in self._snapshot
+
+    def __invert__(self):
+        return self._isolate_block()
+
+    @contextmanager
+    def _isolate_block(self):
+        yield self
+
+    def __setattr__(self, key, value):
+        raise Exception('snapshots are read-only')
+
+    __setitem__ = __setattr__
+
+    def __call__(self, *args, **kwargs):
+        raise Exception('snapshots are read-only')
+
+
+class Snapshot(object):
+
+    """
+    Read-only view of the values and expressions of a reactive context as of the
+    last completed update (see :meth:`Context.snapshot`).
+
+    Reading from a snapshot never blocks or affects the context, even while it is
+    being flushed (possibly from another thread or greenlet). Expressions that were
+    out of date at the time are evaluated within the snapshot, from the values of
+    the snapshot, and the results are kept for the lifetime of the handle.
+
+    Values overwritten after the snapshot was taken are retained until the snapshot
+    is closed, so snapshots should be closed (or used as context managers) once
+    they are no longer needed. Values modified in place are not versioned.
+
+    Attributes
+    ----------
+    epoch : int
+        Number of the update the snapshot reflects.
+    env : object
+        Environment-like accessor to the snapshot (``snapshot.env.a``).
+
+    Examples
+    --------
+    >>> with rc.snapshot() as snapshot:
+    ...     export(snapshot['a'], snapshot.env.b)
+    """
+
+    def __init__(self, context):
+        # the epoch is registered along with reading it, so that it cannot be pruned
+        # in between (see Context._commit)
+        with context._snapshot_lock:
+            epoch = context._committed
+            context._snapshots[epoch] = context._snapshots.get(epoch, 0) + 1
+        self.context = context
+        self.epoch = epoch
+        self.env = _SnapshotEnvironment(self)
+        self._computed = {}
+
+    def get_value(self, name):
+        """
+        Return the value of a reactive value or expression as of the snapshot.
+
+        Parameters
+        ----------
+        name : string
+            Name of a reactive value or expression.
+        """
+        if name in self._computed:
+            return self._computed[name]
+        if self.context is None:
+            raise Exception('snapshot is closed')
+        obj = self.context._objects.get(name)
+        found = obj._value_at(self.epoch) if obj is not None else None
+        if found is None:
+            raise UndefinedKey(name)
+        if obj.is_observer():
+            raise Exception('cannot get the value of observer "%s"' % name)
+        value, current = found
+        if not current:
+            value = obj.func(self.env)
+            if _is_future(value):
+                value = _wait(value)
+            self._computed[name] = value
+        return value
+
+    def __getitem__(self, name):
+        return self.get_value(name)
+
+    def __contains__(self, name):
+        obj = self.context._objects.get(name) if self.context is not None else None
+        return obj is not None and obj._value_at(self.epoch) is not None
+
+    def close(self):
+        """
+        Release the snapshot, so that the values only it needs can be discarded.
+        """
+        if self.context is not None:
+            self._release(self.context, self.epoch)
+            self.context = None
+            self._computed = {}
+
+    @staticmethod
+    def _release(context, epoch):
+        with context._snapshot_lock:
+            count = context._snapshots[epoch] - 1
+            if count:
+                context._snapshots[epoch] = count
+            else:
+                del context._snapshots[epoch]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __del__(self):
+        if getattr(self, 'context', None) is not None:
+            self.close()
+
+
 class Context(object):
 
     """
@@ -303,22 +1516,82 @@ class Context(object):
     formatter : function (optional)
         If specified, all values will be first passed using this formatter when
         logging.
+    max_cache_entries : int (optional)
+        Maximum total number of values cached by all memoized expressions in the
+        context; least recently used values are evicted first.
+    max_cache_bytes : int (optional)
+        Maximum total approximate size in bytes of values cached by all memoized
+        expressions in the context (see :func:`translucent.memo.sizeof`).
+    cutoff : bool (optional, default: `False`)
+        Indicates whether the context should run in push-pull mode in which setting a
+        reactive value only invalidates its direct dependents and marks the rest of its
+        descendants as stale. A stale expression or observer is re-checked against its
+        parents before running, and the propagation stops at expressions whose
+        recomputed value has the same hash as before (early cutoff).
+    flush_workers : int (optional)
+        If set, flushes run the queued observers concurrently in a pool of at most
+        `flush_workers` greenlets (requires gevent) rather than one at a time; see
+        :meth:`flush`.
+    threadsafe : bool (optional, default: `False`)
+        Indicates whether the context can be used from multiple threads. Writes,
+        flushes and evaluations are serialized by a per-context re-entrant lock, and
+        the call stack is only ever used by the thread holding it. Threads reading
+        values or up-to-date expressions through the context or its environment do
+        not wait for the lock, and their reads are never recorded as dependencies of
+        whatever is being evaluated at the time. The isolation blocks of the
+        environment are local to each thread. Objects should not be modified directly
+        (e.g. with :meth:`.Value.set_value`) but through the context.
     """
 
-    __slots__ = ('safe', 'env', '_objects', '_call_stack', '_pending', '_log_stream',
-        '_log_indent', '_fmt_value', '_flush_queue')
+    __slots__ = ('safe', 'cutoff', 'flush_workers', 'env', '_lock', '_objects', '_call_stack',
+        '_running', '_pending', '_log_stream', '_log_indent', '_fmt_value', '_flush_queue',
+        '_dirty', '_transaction_depth', '_version', '_cache_budget', '_depth', '_listeners',
+        '_span_depth', '_profiler', '_recorder', '_prefetched', '_epoch', '_committed',
+        '_snapshots', '_snapshot_lock', '_touched', '_flushing', '_deferred')
 
-    def __init__(self, safe=True, log=None, formatter=None):
+    # maximum nesting of expression evaluations before they are deferred
+    _max_depth = 40
+
+    def __init__(self, safe=True, log=None, formatter=None, cutoff=False,
+            max_cache_entries=None, max_cache_bytes=None, flush_workers=None,
+            threadsafe=False):
+        if threadsafe and flush_workers:
+            raise Exception('flush_workers cannot be used in a thread-safe context')
         self.safe = safe
-        self.env = Environment(self)
+        self.cutoff = cutoff
+        self.flush_workers = flush_workers
+        self._cache_budget = CacheBudget(max_cache_entries, max_cache_bytes)
+        if threadsafe:
+            self._lock = _ContextLock()
+            self.env = _ThreadSafeEnvironment(self)
+        else:
+            self._lock = None
+            self.env = Environment(self)
 
         self._objects = {}
         self._call_stack = []
+        self._running = defaultdict(int)
+        self._depth = 0
         self._pending = defaultdict(list)
         self._log_stream = None
         self._log_indent = 0
-        self._fmt_value = repr
-        self._flush_queue = []
+        self._fmt_value = _no_format
+        self._listeners = []
+        self._span_depth = 0
+        self._profiler = None
+        self._recorder = None
+        self._prefetched = []
+        self._flush_queue = _FlushQueue()
+        self._dirty = set()
+        self._transaction_depth = 0
+        self._version = 0
+        self._committed = 0
+        self._epoch = 1
+        self._snapshots = {}
+        self._snapshot_lock = threading.Lock()
+        self._touched = []
+        self._flushing = False
+        self._deferred = None
 
         if log is True:
             self.start_log(formatter=formatter)
@@ -485,9 +1758,11 @@ class Context(object):
         """
         Assign values to one or more :class:`.Value` objects.
 
-        After the value is set, all observers and expressions depending on this
-        value are invalidated and the context is flushed (i.e. any observers that
-        were invalidated are scheduled to run).
+        After the values are set, all observers and expressions depending on these
+        values are invalidated and the context is flushed (i.e. any observers that
+        were invalidated are scheduled to run). All of the values are assigned within
+        a single transaction, so the context is flushed only once and observers never
+        see a partially applied update.
 
         Parameters
         ----------
@@ -511,23 +1786,28 @@ class Context(object):
         >>> rc.set_value(b=3, _auto_add=True)
         """
         auto_add = kwargs.pop('_auto_add', False)
-        for k, v in self._get_args(*args, **kwargs):
-            if auto_add and k not in self:
-                return self.new_value(k, v)
-            obj = self[k]
-            if not obj.is_value():
-                raise Exception('"%s" is not a reactive value' % k)
-            with self.log_block('set_value(%s, %r)', k, self._fmt_value(v)):
-                obj.set_value(v)
+        with self.transaction():
+            for k, v in self._get_args(*args, **kwargs):
+                if auto_add and k not in self:
+                    self.new_value(k, v)
+                    continue
+                obj = self[k]
+                if not obj.is_value():
+                    raise Exception('"%s" is not a reactive value' % k)
+                with self.log_block('set_value(%s, %r)', k, self._fmt_value(v)):
+                    obj.set_value(v)
 
-    def get_value(self, name, isolate=False):
+    def get_value(self, name, isolate=False, caller=None):
+        if self._lock is not None and caller is None and self._lock.owner != thread.get_ident():
+            return self._read(name, isolate)
         if name not in self:
             raise UndefinedKey(name)
         obj = self[name]
         if obj.is_observer():
             raise Exception('cannot get the value of observer "%s"' % name)
         if not isolate:
-            caller = self._get_caller()
+            if caller is None:
+                caller = self._get_caller()
             if caller is not None:
                 if caller != obj:
                     caller.add_parent(obj)
@@ -535,6 +1815,8 @@ class Context(object):
                     self.log('[called from outside the context]')
         with self.log_block('get_value(%s)%s', name, ' [isolated]' * isolate):
             value = obj.get_value(isolate=isolate)
+        if not isolate and caller and caller is not obj and obj.height >= caller.height:
+            caller.height = obj.height + 1
         if not isolate and caller and caller.is_expression() and caller.memoized:
             caller._update_cache(name, value)
         self.log('=> %s', self._fmt_value(value))
@@ -545,18 +1827,78 @@ class Context(object):
         Flush the reactive context.
 
         All observers that were added to the flush queue due to invalidation will be
-        instantly run.
+        instantly run. Observers are run in the order of their height in the dependency
+        graph, so that an observer never runs before the observers it is upstream of;
+        an observer that is already pending in the queue is never scheduled twice, so
+        it runs at most once per flush unless it invalidates itself while running.
+
+        If the context has `flush_workers` set, the observers in the queue are instead
+        run concurrently in batches, each observer in a greenlet of a bounded pool;
+        the expressions they read are still evaluated one at a time and only once per
+        batch. Writes made by the observers are applied immediately, but the observers
+        they invalidate run in the next batch. The observer runs overlap, so the
+        nesting depths of trace events and log messages are not meaningful within a
+        batch. If an observer raises an exception, the rest of the batch completes
+        before it is re-raised.
         """
-        if self._call_stack:
-            self.log('no flush (already running)')
-        else:
-            with self.log_block('flush()'):
-                while self._flush_queue:
-                    obj = self._flush_queue.pop()
-                    with self.log_block('flush_queue.pop(%s).run()', obj.name):
-                        obj.run()
-            if self._flush_queue:
-                self.flush()
+        with self._locked():
+            if self._call_stack:
+                self.log('no flush (already running)')
+            elif self._transaction_depth:
+                self.log('no flush (transaction)')
+            else:
+                self._flushing = True
+                try:
+                    self._flush()
+                finally:
+                    self._flushing = False
+                self._commit()
+
+    def _flush(self):
+        with self._span('flush' if self._flush_queue else None, None, 'flush()'):
+            if self._prefetched and self._flush_queue:
+                self._prefetch()
+            if self.flush_workers:
+                self._flush_concurrently()
+            while self._flush_queue:
+                obj = self._flush_queue.pop()
+                if self.cutoff:
+                    obj._update()
+                if not obj.invalidated:
+                    self.log('flush_queue.pop(%s) [up to date]', obj.name)
+                    self._dirty.discard(obj)
+                    continue
+                with self.log_block('flush_queue.pop(%s).run()', obj.name):
+                    obj.run()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager that groups multiple writes into a single atomic update.
+
+        Within a transaction, reactive values are assigned and their dependents
+        are invalidated as usual, but the context is not flushed until the outermost
+        transaction exits, so each invalidated observer runs once and only sees the
+        fully applied state. Transactions can be nested. If an exception is raised,
+        the writes made so far are kept and the invalidated observers run on the
+        next flush.
+
+        Examples
+        --------
+        >>> rc = Context()
+        >>> rc.new_value(a=1, b=2)
+        >>> with rc.transaction() as env:
+        ...     env.a = 10
+        ...     env.b = 20
+        """
+        with self._locked():
+            self._transaction_depth += 1
+            try:
+                with self.log_block('transaction()'):
+                    yield self.env
+            finally:
+                self._transaction_depth -= 1
+            self.flush()
 
     def run(self):
         """
@@ -565,27 +1907,96 @@ class Context(object):
         If the context runs in safe mode, hash integrity will be verified before
         the observers are scheduled to run.
         """
-        if self.safe:
-            self._check_hash_integrity()
-        with self.log_block('run()'):
-            for obj in self._objects.itervalues():
-                if obj.is_observer() and obj.invalidated:
-                    obj.run()
-            self.flush()
+        with self._locked():
+            if self.safe:
+                self._check_hash_integrity()
+            with self.log_block('run()'):
+                for obj in self._dirty:
+                    self._flush_queue.push(obj)
+                self.flush()
+
+    def snapshot(self):
+        """
+        Take a consistent read-only snapshot of the values and expressions of the
+        context.
+
+        The snapshot reflects the state of the context after the last completed
+        update (a transaction, a flush or an evaluation started from outside of the
+        context); changes made by an update in progress, such as a flush running in
+        another thread or greenlet, are not visible to it. Reading from the snapshot
+        does not wait for the update to finish (even in a thread-safe context) and
+        does not hold it up.
+
+        Returns
+        -------
+        snapshot : :class:`.Snapshot`
+            Snapshot handle, to be closed once it is no longer needed.
 
-    def memoize(self, expr, enable=True):
+        Examples
+        --------
+        >>> rc = Context()
+        >>> rc.new_value(a=1)
+        >>> rc.new_expression('b', lambda env: env.a * 2)
+        >>> snapshot = rc.snapshot()
+        >>> rc.set_value(a=2)
+        >>> snapshot['a'], snapshot['b'], rc['b'].get_value()
+        (1, 2, 4)
+        >>> snapshot.close()
+        """
+        return Snapshot(self)
+
+    def memoize(self, expr, enable=True, max_entries=None, max_bytes=None, store=None,
+            pure=False):
         """
         Enable or disable memoization (caching) of a reactive expression. A cached
         expression internally stores its returned values associated with the sets of
         values (hashes, to be precise) of its dependencies; when invalidated, it
         will first do a cache lookup before propagating the invalidation state.
 
+        The cache is keyed only on the dependencies the expression actually read,
+        grouped by the sequence of their names in the order they were read, so a
+        lookup is a single hash probe per distinct sequence of dependencies regardless
+        of the size of the context or the number of cached values. Dependencies that
+        are out of date are only evaluated during a lookup if the ones read before
+        them match a cached entry, so a lookup never evaluates an expression the
+        memoized expression would not read itself.
+
+        The cache can be bounded by the number of entries and by their approximate
+        total size; once a limit is exceeded, the least recently used values are
+        evicted. The limits set on the context apply on top of these.
+
+        If a persistent store is passed, it is consulted on cache misses and updated
+        with newly computed values, so the results survive process restarts. Values
+        in the store are keyed by the name, the code, the default arguments and the
+        closure of the expression function (see :func:`translucent.memo.func_key`)
+        and by process-independent hashes of its dependencies. The values of
+        functions whose defaults or closure cannot be hashed cannot be stored.
+
+        An expression declared pure (its value depends on nothing but the reactive
+        objects it reads) is backed by :data:`translucent.memo.shared_store` unless
+        another store is passed, so its values are shared by all contexts of the
+        process that have an expression with the same name and function key. The
+        shared store is bounded (see :meth:`translucent.memo.SharedStore.set_limits`).
+
+        Memoizing an expression that is already memoized keeps the limits and the
+        store that are not passed again. Disabling memoization discards the cached
+        values (the store, if any, is left as is).
+
         Parameters
         ----------
         expr : string or :class:`.Expression`
             Reactive expression, can be specified by name or by reference.
         enable : bool (optional, default: `True`)
             Enable or disable memoization of a reactive expression.
+        max_entries : int (optional)
+            Maximum number of values cached by the expression.
+        max_bytes : int (optional)
+            Maximum total approximate size in bytes of values cached by the expression
+            (see :func:`translucent.memo.sizeof`).
+        store : :class:`translucent.memo.DiskStore` (optional)
+            Persistent store backing the cache of the expression.
+        pure : bool (optional, default: `False`)
+            Share the values of the expression with other contexts of the process.
 
         Examples
         --------
@@ -596,15 +2007,280 @@ class Context(object):
         >>> assert b.memoized
         >>> rc.memoize(b, False)
         >>> assert not b.memoized
+        >>> rc.memoize(b, max_entries=100, max_bytes=2 ** 20)
+        >>> rc.memoize(b, pure=True)
+        """
+        with self._locked():
+            obj = expr if isinstance(expr, Expression) else self[expr]
+            if not obj.is_expression():
+                raise Exception('can only cache reactive expressions')
+            if enable and (store is not None or pure):
+                key = func_key(obj.func)
+                if key is None:
+                    raise Exception('cannot share or persist the values of "%s": the '
+                        'defaults or the closure of its function cannot be hashed' % obj.name)
+            obj.memoized = enable
+            if enable:
+                if obj._cache is None:
+                    obj._cache = MemoCache(budget=self._cache_budget)
+                    obj._current_cache = OrderedDict()
+                cache = obj._cache
+                if max_entries is not None:
+                    cache.max_entries = max_entries
+                if max_bytes is not None:
+                    cache.max_bytes = max_bytes
+                if store is not None or pure:
+                    cache.store = shared_store if store is None else store
+                    cache.namespace = '%s:%s' % (obj.name, key)
+            elif obj._cache is not None:
+                # the cached values no longer count towards the limits of the context
+                obj._cache.clear()
+                obj._cache = None
+                obj._current_cache = None
+
+    def freeze(self, value):
+        """
+        Mark a reactive value as immutable.
+
+        The hash of a frozen value is computed once and trusted from then on: it is
+        never re-hashed by the integrity checks in safe mode, and assigning the same
+        object to it again is a no-op. Numpy arrays, as well as the blocks of pandas
+        objects, are made read-only in place to prevent accidental modifications;
+        other values are expected not to be modified in place. Values assigned to a
+        frozen value later on are frozen as well.
+
+        Parameters
+        ----------
+        value : string or :class:`.Value`
+            Reactive value, can be specified by name or by reference.
+
+        Examples
+        --------
+        >>> import numpy as np
+        >>> rc = Context()
+        >>> a = rc.new_value(a=np.arange(10))
+        >>> rc.freeze('a')
+        >>> assert a.frozen and not a.value.flags.writeable
+        """
+        with self._locked():
+            obj = value if isinstance(value, Value) else self[value]
+            if not obj.is_value():
+                raise Exception('can only freeze reactive values')
+            self.log('%s.freeze()', obj.name)
+            freeze(obj.value)
+            obj.frozen = True
+
+    def prefetch(self, expr, enable=True):
+        """
+        Enable or disable prefetching of a reactive expression whose function returns
+        a future (see :class:`.Expression`).
+
+        At the start of each flush, the context runs all prefetched expressions that
+        are out of date up to the point where they return their futures, and only then
+        runs the observers, which wait for the results as they read the expressions.
+        This way, the latencies of independent slow expressions overlap instead of
+        adding up. Expressions are prefetched automatically once they have returned a
+        future, but whether an expression returns a future is only known once it has
+        run, so the expressions first evaluated by a flush (e.g. the first one) are
+        only evaluated concurrently if prefetching was enabled for them explicitly.
+
+        An expression that fails to start (e.g. because it reads a reactive object
+        that does not exist yet) is left out of date and re-run once it is read.
+
+        Parameters
+        ----------
+        expr : string or :class:`.Expression`
+            Reactive expression, can be specified by name or by reference.
+        enable : bool (optional, default: `True`)
+            Enable or disable prefetching of the expression.
+
+        Examples
+        --------
+        >>> import gevent
+        >>> rc = Context()
+        >>> rc.new_value(a=1)
+        >>> rc.new_expression('b', lambda env: gevent.spawn(slow_query, env.a))
+        >>> rc.new_expression('c', lambda env: gevent.spawn(slow_query, env.a))
+        >>> rc.prefetch('b')
+        >>> rc.prefetch('c')
+        >>> rc.new_observer('d', lambda env: env.b + env.c)
+        >>> rc.run()
+        """
+        with self._locked():
+            obj = expr if isinstance(expr, Expression) else self[expr]
+            if not obj.is_expression():
+                raise Exception('can only prefetch reactive expressions')
+            if enable and not obj.prefetch:
+                self._prefetched.append(obj)
+            elif not enable and obj.prefetch:
+                self._prefetched.remove(obj)
+            obj.prefetch = enable
+
+    def cache_info(self, expr=None):
+        """
+        Return memoization statistics for the whole context or for a single reactive
+        expression.
+
+        Parameters
+        ----------
+        expr : string or :class:`.Expression` (optional)
+            Reactive expression, can be specified by name or by reference.
+
+        Returns
+        -------
+        info : dict
+            ``hits``, ``misses`` and ``evictions`` counters along with the current
+            number of cached ``entries`` and their approximate size (``nbytes``, only
+            tracked if a size limit is set).
+
+        Examples
+        --------
+        >>> rc = Context(max_cache_entries=1000)
+        >>> rc.new_value(a=1)
+        >>> b = rc.new_expression('b', lambda env: env.a)
+        >>> rc.memoize('b')
+        >>> b.get_value()
+        1
+        >>> rc.cache_info()['misses']
+        1
         """
-        if isinstance(expr, Expression):
-            expr.memoized = enable
+        if expr is None:
+            caches = [obj._cache for obj in self._objects.values()
+                if obj.is_expression() and obj._cache is not None]
         else:
-            obj = self[expr]
-            if obj.is_expression():
-                obj.memoized = enable
-            else:
+            obj = expr if isinstance(expr, Expression) else self[expr]
+            if not obj.is_expression():
                 raise Exception('can only cache reactive expressions')
+            caches = [obj._cache] if obj._cache is not None else []
+        return {
+            'hits': sum(cache.hits for cache in caches),
+            'misses': sum(cache.misses for cache in caches),
+            'evictions': sum(cache.evictions for cache in caches),
+            'entries': sum(len(cache) for cache in caches),
+            'nbytes': sum(cache.nbytes for cache in caches)
+        }
+
+    def start_profile(self):
+        """
+        Start collecting per-node execution counters, discarding the ones collected
+        previously. The counters are accumulated from trace events (see
+        :meth:`add_listener`), so there is no overhead while profiling is off.
+        """
+        self.stop_profile()
+        self._profiler = Profiler()
+        self.add_listener(self._profiler)
+
+    def stop_profile(self):
+        """
+        Stop collecting per-node execution counters; the counters collected so far
+        are still reported by :meth:`stats`.
+        """
+        if self._profiler is not None and self._profiler in self._listeners:
+            self.remove_listener(self._profiler)
+
+    def stats(self, sort='total_time'):
+        """
+        Return per-node execution statistics collected since :meth:`start_profile`
+        was called.
+
+        Parameters
+        ----------
+        sort : string or `None` (optional, default: ``'total_time'``)
+            Column to sort the table by in descending order (see
+            :class:`translucent.profiling.Stats` for the list of columns); if `None`,
+            the rows are sorted by node name.
+
+        Returns
+        -------
+        stats : :class:`translucent.profiling.Stats`
+            Table with a row per reactive object.
+
+        Examples
+        --------
+        >>> rc = Context()
+        >>> rc.start_profile()
+        >>> rc.new_value(a=1)
+        >>> b = rc.new_expression('b', lambda env: env.a + 1)
+        >>> b.get_value()
+        2
+        >>> rc.stats()[0]['name'], rc.stats()[0]['runs']
+        ('b', 1)
+        """
+        with self._locked():
+            profiler = self._profiler or Profiler()
+            stats = profiler.stats(self._objects[name] for name in sorted(self._objects))
+        if sort is not None:
+            stats.sort_by(sort)
+        return stats
+
+    def graph(self):
+        """
+        Return a snapshot of the dependency graph annotated with the execution
+        counters collected since :meth:`start_profile` was called.
+
+        Returns
+        -------
+        graph : :class:`translucent.profiling.Graph`
+            Nodes, edges and critical path of the last flush, which can be exported
+            to JSON or DOT.
+
+        Examples
+        --------
+        >>> rc = Context()
+        >>> rc.start_profile()
+        >>> rc.new_value(a=1)
+        >>> rc.new_observer('b', lambda env: env.a)
+        >>> rc.run()
+        >>> graph = rc.graph()
+        >>> graph.edges[0]['source'], graph.edges[0]['target']
+        ('a', 'b')
+        >>> graph.critical_path
+        ['b']
+        """
+        with self._locked():
+            profiler = self._profiler or Profiler()
+            return profiler.graph(self._objects[name] for name in sorted(self._objects))
+
+    def start_trace(self, max_events=None):
+        """
+        Start recording flushes, runs, cache lookups, assignments and invalidations
+        in the Chrome trace event format, discarding the previous recording.
+
+        Parameters
+        ----------
+        max_events : int (optional)
+            If set, only the most recent `max_events` events are kept, so the
+            recording can be left on indefinitely.
+
+        Returns
+        -------
+        recorder : :class:`translucent.profiling.TraceRecorder`
+            The recorder, which can be dumped to a JSON file at any time.
+
+        Examples
+        --------
+        >>> rc = Context()
+        >>> recorder = rc.start_trace()
+        >>> rc.new_value(a=1)
+        >>> rc.new_observer('b', lambda env: env.a)
+        >>> rc.run()
+        >>> [event['name'] for event in recorder.events()]
+        ['run(b)', 'flush']
+        >>> recorder.dump('trace.json')
+        """
+        self.stop_trace()
+        self._recorder = TraceRecorder(max_events)
+        self.add_listener(self._recorder)
+        return self._recorder
+
+    def stop_trace(self):
+        """
+        Stop recording trace events and return the recorder (`None` if the events
+        were never recorded).
+        """
+        if self._recorder is not None and self._recorder in self._listeners:
+            self.remove_listener(self._recorder)
+        return self._recorder
 
     def suspend(self, name):
         """
@@ -620,10 +2296,11 @@ class Context(object):
         name : string
             Name of the observer.
         """
-        obj = self[name]
-        if not obj.is_observer():
-            raise Exception('can only suspend observers')
-        obj.suspend()
+        with self._locked():
+            obj = self[name]
+            if not obj.is_observer():
+                raise Exception('can only suspend observers')
+            obj.suspend()
 
     def resume(self, name, run=False):
         """
@@ -641,10 +2318,11 @@ class Context(object):
             If set to `True`, the observer will check its invalidation state after
             resuming and schedule itself to run if necessary.
         """
-        obj = self[name]
-        if not obj.is_observer():
-            raise Exception('can only resume observers')
-        obj.resume(run=run)
+        with self._locked():
+            obj = self[name]
+            if not obj.is_observer():
+                raise Exception('can only resume observers')
+            obj.resume(run=run)
 
     def start_log(self, stream=None, formatter=None):
         self._fmt_value = formatter or repr
@@ -657,25 +2335,65 @@ class Context(object):
         Reset the logging output stream and halt all logging.
         """
         self._log_stream = None
+        self._fmt_value = _no_format
 
     def log(self, fmt, *args):
         if self._log_stream is not None:
             self._log_stream.write('  ' * self._log_indent + fmt % args + '\n')
 
-    @contextmanager
     def log_block(self, fmt=None, *args):
+        """
+        Return a context manager that logs a message and indents the messages logged
+        within it. While logging is off, a shared no-op context manager is returned.
+        """
         if self._log_stream is None:
-            yield
+            return _NULL_BLOCK
+        return _Span(self, None, None, fmt, args)
+
+    def add_listener(self, listener):
+        """
+        Attach a listener that will be called with a :class:`TraceEvent` for every
+        flush, run, cache lookup, assignment and invalidation within the context.
+
+        Events are only created while at least one listener is attached; otherwise,
+        tracing has no overhead.
+
+        Parameters
+        ----------
+        listener : function
+            The function ``listener(event)``.
+
+        Examples
+        --------
+        >>> rc = Context()
+        >>> events = []
+        >>> rc.add_listener(events.append)
+        >>> rc.new_value(a=1)
+        >>> rc.set_value(a=2)
+        >>> events[-1].kind
+        'flush'
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Detach a listener attached with :meth:`add_listener`.
+        """
+        self._listeners.remove(listener)
+
+    def _span(self, kind, node, fmt=None, *args):
+        if self._log_stream is None and not self._listeners:
+            return _NULL_BLOCK
+        return _Span(self, kind, node, fmt, args)
+
+    def _emit(self, kind, node, start=None, cache_hit=None):
+        now = _clock()
+        if start is None:
+            event = TraceEvent(kind, node, now, 0., self._span_depth, cache_hit)
         else:
-            if fmt is not None:
-                self.log(fmt, *args)
-            self._log_indent += 1
-            try:
-                yield
-            except Exception as e:
-                raise e
-            finally:
-                self._log_indent -= 1
+            event = TraceEvent(kind, node, start, now - start, self._span_depth, cache_hit)
+        for listener in list(self._listeners):
+            listener(event)
 
     def __contains__(self, name):
         """
@@ -712,29 +2430,45 @@ class Context(object):
         return self._objects[name]
 
     def _check_hash_integrity(self, accessed=None):
+        """
+        Re-hash the values of the given objects (or of all objects in the context) to
+        detect in-place modifications. Values that are known not to have been
+        modified since they were last hashed (immutable values, read-only numpy
+        arrays and tracked containers whose mutation counter has not changed) are
+        skipped, as are values that have not been read since they were written, so
+        the cost only depends on the size of the values that may have actually changed.
+        """
         if self.safe:
             objects = accessed or self._objects.values()
             for obj in objects:
-                if obj.is_value():
-                    if _fast_hash(obj.value) != obj.hash:
-                        self.log('outdated hash detected for %s', obj.name)
-                        obj.set_value(obj.value)
+                if obj.is_value() and obj._modified():
+                    self.log('outdated hash detected for %s', obj.name)
+                    obj.set_value(obj.value)
             for obj in objects:
-                if not obj.is_value():
-                    if not obj.invalidated and _fast_hash(obj.value) != obj.hash:
-                        raise Exception('non-value object mutated: %s' % obj.name)
+                if not obj.is_value() and not obj.invalidated and obj._modified():
+                    raise Exception('non-value object mutated: %s' % obj.name)
 
     def _register(self, obj):
-        self._objects[obj.name] = obj
         obj.context = self
+        obj.version = self._next_version()
+        obj._written = self._epoch
+        obj._until = None if obj.is_value() else self._epoch
+        self._objects[obj.name] = obj
+        if obj.is_observer():
+            self._dirty.add(obj)
         while self._pending[obj.name]:
-            self._pending[obj.name].pop().run()
+            observer = self._pending[obj.name].pop()
+            if self._transaction_depth:
+                self._flush_queue.push(observer)
+            else:
+                observer.run()
         return obj
 
     def _new_object(self, cls, *args, **kwargs):
         result = []
-        for k, v in self._get_args(*args, **kwargs):
-            result.append(self._register(cls(k, v)))
+        with self.transaction():
+            for k, v in self._get_args(*args, **kwargs):
+                result.append(self._register(cls(k, v)))
         if len(result) is 1:
             return result[0]
 
@@ -742,17 +2476,150 @@ class Context(object):
         if observer not in self._pending[name]:
             self._pending[name].append(observer)
 
+    def _commit(self):
+        # the current state is consistent: new snapshots will see it
+        with self._snapshot_lock:
+            self._committed = self._epoch
+        self._epoch += 1
+        if self._touched:
+            self._prune()
+
+    def _prune(self):
+        # drop the overwritten values no open snapshot (nor the last committed
+        # state) can see any longer; snapshots opened from now on see the last
+        # committed state
+        with self._snapshot_lock:
+            oldest = min(self._snapshots.keys() + [self._committed])
+        if oldest == self._committed:
+            for obj in self._touched:
+                obj._history = None
+            self._touched = []
+            return
+        touched = []
+        for obj in self._touched:
+            history = obj._history
+            start = 0
+            while start < len(history) and (history[start + 1][0] if start + 1 < len(history)
+                    else obj._written) <= oldest:
+                start += 1
+            obj._history = history[start:] or None
+            if obj._history is not None:
+                touched.append(obj)
+        self._touched = touched
+
+    def _next_version(self):
+        self._version += 1
+        return self._version
+
     def _push_call_stack(self, obj):
-        self._call_stack[0:0] = [obj]
+        self._call_stack.append(obj)
+        self._running[obj] += 1
 
     def _pop_call_stack(self, obj):
-        self._call_stack.remove(obj)
+        stack = self._call_stack
+        if stack[-1] is obj:
+            stack.pop()
+        else:
+            del stack[len(stack) - 1 - stack[::-1].index(obj)]
+        self._running[obj] -= 1
+        if not self._running[obj]:
+            del self._running[obj]
 
     def _is_running(self, obj):
-        return obj in self._call_stack
+        return obj in self._running
+
+    def _trampoline(self, obj, isolate=False):
+        """
+        Evaluate a reactive expression outside of any other expression evaluation.
+
+        Once the evaluations are nested ``_max_depth`` levels deep, pulling another
+        expression that needs to be evaluated raises `_Deferred`, which aborts the
+        evaluations down to this point. The deferred expression is then evaluated
+        here and the aborted evaluation is retried, which finds it up to date; this
+        way, dependency chains of any depth are evaluated with bounded recursion.
+        Each expression is computed once, but the functions of the aborted evaluations
+        are run again from the start when retried (about twice as many function calls
+        in a long chain).
+        """
+        pending = [obj]
+        try:
+            while True:
+                self._deferred = None
+                try:
+                    value = pending[-1]._get_value(isolate if len(pending) is 1 else True)
+                except _Deferred as e:
+                    self.log('deferred: %s', e.obj.name)
+                    pending.append(e.obj)
+                    continue
+                pending.pop()
+                if not pending:
+                    return value
+        finally:
+            self._deferred = None
 
     def _get_caller(self):
-        return None if not self._call_stack else self._call_stack[0]
+        return self._call_stack[-1] if self._call_stack else None
+
+    def _locked(self):
+        return self._lock if self._lock is not None else _NULL_BLOCK
+
+    def _read(self, name, isolate=False):
+        # read from a thread not holding the lock of a thread-safe context, which is
+        # never evaluating anything (evaluations hold the lock): values and up-to-date
+        # expressions are read as is (in safe mode, once they have been hashed),
+        # anything else waits for the lock
+        obj = self._objects.get(name)
+        if obj is not None and (obj.is_value() or (obj.is_expression() and
+                not obj.invalidated and not obj.stale and obj._future is None)) and \
+                (not self.safe or obj.frozen or obj._hash_version == obj.version):
+            return obj.value
+        with self._lock:
+            return self.get_value(name, isolate)
+
+    def _flush_concurrently(self):
+        import gevent
+        from gevent.pool import Pool
+        from gevent.lock import RLock
+        pool, lock = Pool(self.flush_workers), RLock()
+        # flushes triggered by the observers are deferred to the next batch
+        self._transaction_depth += 1
+        try:
+            while self._flush_queue:
+                batch = []
+                while self._flush_queue:
+                    batch.append(self._flush_queue.pop())
+                with self.log_block('flush_batch(%s)', ', '.join(obj.name for obj in batch)):
+                    greenlets = [pool.spawn(self._run_observer, obj, lock) for obj in batch]
+                    gevent.joinall(greenlets)
+                for greenlet in greenlets:
+                    if greenlet.value is not None:
+                        exc_type, exc_value, traceback = greenlet.value
+                        raise exc_type, exc_value, traceback
+        finally:
+            self._transaction_depth -= 1
+
+    def _run_observer(self, obj, lock):
+        # runs in a greenlet of the flush pool; returns the exception info on failure
+        try:
+            with lock:
+                if self.cutoff:
+                    obj._update()
+                if not obj.invalidated:
+                    self.log('flush_queue.pop(%s) [up to date]', obj.name)
+                    self._dirty.discard(obj)
+                    return None
+            with self.log_block('flush_queue.pop(%s).run()', obj.name):
+                obj.run(env=_ObserverEnvironment(self, obj, lock))
+        except Exception:
+            return sys.exc_info()
+
+    def _prefetch(self):
+        with self.log_block('prefetch()'):
+            for obj in list(self._prefetched):
+                try:
+                    obj._start()
+                except Exception as e:
+                    self.log('%s failed to start: %r', obj.name, e)
 
     @staticmethod
     def _get_args(*args, **kwargs):
@@ -0,0 +1,226 @@
+# -*- coding: utf-8
+
+from translucent import patch_thread
+patch_thread()
+
+import sys
+from translucent.memo import (MemoCache, CacheBudget, DiskStore, SharedStore, shared_store, sizeof,
+    stable_hash, func_key)
+
+from pytest import raises, importorskip
+
+
+def key(name, h):
+    return (name,), (h,)
+
+
+def test_sizeof():
+
+    assert sizeof(1) == sys.getsizeof(1)
+    assert sizeof([1, 2]) == sys.getsizeof([1, 2]) + 2 * sys.getsizeof(1)
+    assert sizeof({'a': 'b'}) > sys.getsizeof({})
+    x = []
+    x.append(x)
+    assert sizeof(x) == sys.getsizeof(x)
+
+
+def test_sizeof_numpy_pandas():
+
+    np = importorskip('numpy')
+    pd = importorskip('pandas')
+    assert sizeof(np.zeros(1000)) == 8000
+    df = pd.DataFrame({'a': np.zeros(1000)})
+    assert sizeof(df) == df.memory_usage(deep=True).sum()
+
+
+def test_memo_cache_lru():
+
+    cache = MemoCache(max_entries=2)
+    cache.put(key('a', 1), 'x')
+    cache.put(key('a', 2), 'y')
+    assert cache.get(key('a', 1)) == 'x'
+    cache.put(key('a', 3), 'z')
+    assert key('a', 2) not in cache
+    assert key('a', 1) in cache and key('a', 3) in cache
+    assert cache.evictions is 1
+    assert cache.hits is 1
+    raises(KeyError, cache.get, key('a', 2))
+
+    cache.put(key('b', 1), 'w')
+    assert sorted(cache.signatures()) == [('a',), ('b',)]
+    cache.clear()
+    assert len(cache) is 0
+    assert not cache.signatures()
+
+
+def test_memo_cache_match():
+
+    cache = MemoCache(max_entries=2)
+    cache.put((('a', 'b', 'c'), (1, 2, 3)), 'x')
+    assert cache.match(('a', 'b', 'c'), [])
+    assert cache.match(('a', 'b', 'c'), [1])
+    assert cache.match(('a', 'b', 'c'), [1, 2])
+    assert not cache.match(('a', 'b', 'c'), [2])
+    assert not cache.match(('a', 'b'), [])
+    assert not cache.match(('a', 'b'), [1])
+
+    cache.put((('a', 'b', 'c'), (1, 4, 3)), 'y')
+    cache.put((('a', 'b', 'c'), (5, 4, 3)), 'z')
+    assert not cache.match(('a', 'b', 'c'), [1, 2])
+    assert cache.match(('a', 'b', 'c'), [1, 4])
+    cache.clear()
+    assert not cache.match(('a', 'b', 'c'), [])
+    assert not cache._prefixes
+
+
+def test_memo_cache_bytes():
+
+    cache = MemoCache(max_bytes=3 * sizeof('x' * 100))
+    for i in range(5):
+        cache.put(key('a', i), 'x' * 100)
+    assert len(cache) is 3
+    assert cache.nbytes == 3 * sizeof('x' * 100)
+    assert cache.evictions is 2
+
+    cache.put(key('a', 10), 'x' * 1000)
+    assert len(cache) is 0
+    assert cache.nbytes is 0
+
+
+def test_cache_budget():
+
+    budget = CacheBudget(max_entries=3)
+    c1 = MemoCache(budget=budget)
+    c2 = MemoCache(max_entries=1, budget=budget)
+    c1.put(key('a', 1), 1)
+    c1.put(key('a', 2), 2)
+    c2.put(key('b', 1), 3)
+    c2.put(key('b', 2), 4)
+    assert len(budget) is 3
+    assert c2.evictions is 1
+
+    c1.get(key('a', 1))
+    c1.put(key('a', 3), 5)
+    assert len(budget) is 3
+    assert key('a', 2) not in c1
+    assert c1.evictions is 1
+    assert key('a', 1) in c1 and key('b', 2) in c2
+
+
+def test_func_key():
+
+    f1 = lambda env: env.a + 1
+    f2 = lambda env: env.a + 2
+    f3 = lambda env: env.a + 1
+    assert func_key(f1) == func_key(f3)
+    assert func_key(f1) != func_key(f2)
+    assert func_key(f1).startswith(__name__ + '.<lambda>:')
+    assert func_key(len) == '__builtin__.len'
+
+    def make(n, scale=1):
+        return lambda env: env.a * n * scale
+
+    assert func_key(make(1)) == func_key(make(1))
+    assert func_key(make(1)) != func_key(make(2))
+    assert func_key(make(1)) != func_key(make(1, 2))
+    assert func_key(lambda env, n=1: n) != func_key(lambda env, n=2: n)
+    assert func_key(make(f1)) != func_key(make(f2))
+    assert func_key(make(x for x in [1])) is None
+
+    def fact(n):
+        return n * fact(n - 1) if n else 1
+
+    assert func_key(fact) == func_key(fact)
+
+
+def test_stable_hash():
+
+    assert stable_hash([1, 'a', {'b': 2}]) == stable_hash([1, 'a', {'b': 2}])
+    assert stable_hash([1, 2]) != stable_hash([2, 1])
+
+
+def test_disk_store(tmpdir):
+
+    store = DiskStore(str(tmpdir))
+    k1 = key('a', stable_hash(1))
+    k2 = (('a', 'b'), (stable_hash(1), stable_hash(2)))
+    raises(KeyError, store.get, 'ns', k1)
+    assert store.signatures('ns') == []
+
+    store.put('ns', k1, [1, 2, 3])
+    store.put('ns', k2, {'x': 1})
+    assert store.get('ns', k1) == [1, 2, 3]
+    assert store.get('ns', k2) == {'x': 1}
+    raises(KeyError, store.get, 'other', k1)
+
+    store = DiskStore(str(tmpdir))
+    assert store.signatures('ns') == [('a',), ('a', 'b')]
+    assert store.get('ns', k1) == [1, 2, 3]
+    assert store.match('ns', ('a', 'b'), [])
+    assert store.match('ns', ('a', 'b'), [stable_hash(1)])
+    assert not store.match('ns', ('a', 'b'), [stable_hash(2)])
+    assert not store.match('ns', ('b',), [])
+
+    store.clear('ns')
+    raises(KeyError, store.get, 'ns', k1)
+    assert store.signatures('ns') == []
+
+
+def test_disk_store_shared_directory(tmpdir):
+
+    first, second = DiskStore(str(tmpdir)), DiskStore(str(tmpdir))
+    assert first.signatures('ns') == second.signatures('ns') == []
+    first.put('ns', key('a', stable_hash(1)), 1)
+    second.put('ns', key('b', stable_hash(2)), 2)
+    assert first.signatures('ns') == second.signatures('ns') == [('a',), ('b',)]
+    assert DiskStore(str(tmpdir)).signatures('ns') == [('a',), ('b',)]
+    assert second.get('ns', key('a', stable_hash(1))) == 1
+
+
+def test_disk_store_mmap(tmpdir):
+
+    np = importorskip('numpy')
+    pd = importorskip('pandas')
+    store = DiskStore(str(tmpdir))
+    store.put('ns', key('a', 1), np.arange(1000.))
+    store.put('ns', key('a', 2), pd.DataFrame({'x': np.arange(10.)}))
+
+    store = DiskStore(str(tmpdir))
+    array = store.get('ns', key('a', 1))
+    assert isinstance(array, np.memmap)
+    assert array.sum() == np.arange(1000.).sum()
+    assert store.get('ns', key('a', 2)).x.sum() == 45
+
+
+def test_shared_store():
+
+    store = SharedStore(max_entries=2)
+    raises(KeyError, store.get, 'ns', key('a', 1))
+    assert store.signatures('ns') == []
+    value = [1, 2, 3]
+    store.put('ns', key('a', 1), value)
+    store.put('other', (('a', 'b'), (1, 2)), 4)
+    assert store.get('ns', key('a', 1)) is value
+    raises(KeyError, store.get, 'other', key('a', 1))
+    assert store.signatures('other') == [('a', 'b')]
+    assert store.match('other', ('a', 'b'), [1])
+    assert not store.match('other', ('a', 'b'), [2])
+    assert not store.match('missing', ('a',), [])
+
+    store.put('ns', key('a', 2), 5)
+    assert len(store) is 2
+    raises(KeyError, store.get, 'other', (('a', 'b'), (1, 2)))
+    store.clear('ns')
+    assert len(store) is 0
+    assert store.signatures('ns') == []
+
+    store = SharedStore(max_bytes=sizeof([0] * 100) * 5 / 2)
+    for i in range(3):
+        store.put('ns', key('a', i), [i] * 100)
+    assert len(store) is 2
+    store.set_limits(max_entries=1, max_bytes=store.budget.max_bytes)
+    assert len(store) is 1
+    assert store.get('ns', key('a', 2)) == [2] * 100
+    store.set_limits()
+    assert store.budget.max_entries is None and store.budget.max_bytes is None
+    assert shared_store.budget.max_entries and shared_store.budget.max_bytes
@@ -0,0 +1,118 @@
+# -*- coding: utf-8
+
+from translucent import patch_thread
+patch_thread()
+
+import os
+import time
+from translucent.pool import ProcessPool
+from translucent.reactive import Context
+
+from pytest import raises, importorskip, fixture
+
+
+def square(x):
+    return x * x
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def pid(x):
+    time.sleep(0.1)
+    return os.getpid()
+
+
+def slow_fail(x):
+    time.sleep(0.1)
+    raise ValueError(x)
+
+
+def rendezvous(path, name):
+    # returns whether the other task and the parent process were running meanwhile
+    open(os.path.join(path, name), 'w').close()
+    for i in range(1000):
+        if len(os.listdir(path)) >= 3:
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def total(array, scale=1):
+    return array.sum() * scale, array.flags.writeable
+
+
+def double(array):
+    return array * 2
+
+
+@fixture
+def pool(tmpdir):
+    pool = ProcessPool(processes=2, max_nbytes=1000, tmpdir=str(tmpdir))
+    yield pool
+    pool.close()
+
+
+def test_submit(pool):
+
+    future = pool.submit(square, 3)
+    assert future.get() == 9 and future.ready()
+    futures = [pool.submit(pid, i) for i in range(5)]
+    pids = [f.get() for f in futures]
+    assert len(set(pids)) == 2 and os.getpid() not in pids
+    assert len(pool._workers) == 2 and not pool._running
+
+    future = pool.submit(fail, 1)
+    with raises(ValueError) as e:
+        future.get()
+    assert 'fail' in e.value.remote_traceback
+    future = pool.submit(lambda x: x, 1)
+    raises(Exception, future.get)
+    assert pool.submit(square, 4).get() == 16
+
+    futures = [pool.submit(slow_fail, 1), pool.submit(square, 2), pool.submit(square, 5)]
+    assert futures[2].get() == 25 and futures[1].get() == 4
+    raises(ValueError, futures[0].get)
+
+    pool.close()
+    raises(Exception, pool.submit, square, 1)
+
+
+def test_shared_memory(pool, tmpdir):
+
+    np = importorskip('numpy')
+    array = np.arange(1000.)
+    assert pool.submit(total, array, scale=2).get() == (array.sum() * 2, False)
+    assert pool.submit(total, array[:10]).get() == (45., True)
+    result = pool.submit(double, array).get()
+    assert isinstance(result, np.memmap) and result[-1] == 1998
+    assert os.listdir(pool._tmpdir) == []
+
+
+def test_pool_expression(pool, tmpdir):
+
+    gevent = importorskip('gevent')
+    path = str(tmpdir.mkdir('rendezvous'))
+
+    def touch():
+        # only runs if waiting for the workers does not block the process
+        for i in range(1000):
+            if len(os.listdir(path)) >= 2:
+                open(os.path.join(path, 'parent'), 'w').close()
+                return
+            gevent.sleep(0.005)
+
+    rc = Context()
+    rc.new_value(path=path, a='a', b=2)
+    rc.new_expression('c', pool.expression(rendezvous, 'path', 'a'))
+    rc.new_expression('d', lambda env: pool.submit(rendezvous, env.path, 'd'))
+    rc.prefetch('c')
+    rc.prefetch('d')
+    rc.new_expression('e', pool.expression(square, 'b'))
+    rc.new_observer('f', lambda env: (env.c, env.d, env.e))
+    greenlet = gevent.spawn(touch)
+    rc.run()
+    greenlet.join()
+    assert rc['f'].value == (True, True, 4)
+    assert [parent.name for parent in rc['e'].parents] == ['b']
@@ -6,8 +6,11 @@ patch_thread()
 import sys
 from cStringIO import StringIO
 from translucent.reactive import UndefinedKey, Context, Value, Expression, Observer
+from translucent.memo import DiskStore, shared_store, stable_hash
+from translucent.tracking import TrackedList
+from translucent import reactive
 
-from pytest import raises
+from pytest import raises, importorskip
 
 
 def test_object_names():
@@ -210,6 +213,879 @@ def test_order_of_evaluation():
     assert rc['c'].exec_count is 2
 
 
+def test_ordered_set():
+
+    items = reactive._OrderedSet([3, 1, 2, 1])
+    assert list(items) == [3, 1, 2] and len(items) is 3
+    items.discard(1)
+    items.discard(4)
+    items.add(1)
+    assert list(items) == [3, 2, 1] and 1 in items and 4 not in items
+    for i in range(100):
+        items.add(i + 10)
+    for i in range(90):
+        items.discard(i + 10)
+    assert len(items._items) < 40
+    assert list(items) == [3, 2, 1] + range(100, 110)
+
+
+def test_wide_graph():
+
+    rc = Context()
+    rc.new_value(a=1)
+    for i in range(2000):
+        rc.new_observer('b%d' % i, lambda env: env.a)
+    rc.run()
+    assert len(rc['a'].children) == 2000
+    rc.set_value(a=2)
+    assert all(rc['b%d' % i].value is 2 for i in range(2000))
+    assert len(rc['a'].children) == 2000
+    assert not rc._call_stack and not rc._running
+
+
+def test_deep_chain():
+
+    n = 5000
+    for cutoff in (False, True):
+        rc = Context(cutoff=cutoff)
+        rc.new_value(e0=0)
+        for i in range(1, n):
+            rc.new_expression('e%d' % i, lambda env, i=i: env['e%d' % (i - 1)] + 1)
+        rc.new_observer('o', lambda env: env['e%d' % (n - 1)])
+        rc.run()
+        assert rc['o'].value == n - 1
+        assert all(rc['e%d' % i].exec_count is 1 for i in range(1, n))
+        rc.set_value(e0=1)
+        assert rc['o'].value == n
+        assert all(rc['e%d' % i].exec_count is 2 for i in range(1, n))
+        assert rc['o'].exec_count is 2
+        assert not rc._call_stack and not rc._depth
+
+
+def test_deep_chain_bare_except():
+
+    def step(i):
+        def func(env):
+            try:
+                return env['e%d' % (i - 1)] + 1
+            except:
+                return -999
+        return func
+
+    n = 200
+    rc = Context()
+    rc.new_value(e0=0)
+    for i in range(1, n):
+        rc.new_expression('e%d' % i, step(i))
+    assert rc.get_value('e%d' % (n - 1)) == n - 1
+    assert all(rc['e%d' % i].exec_count is 1 for i in range(1, n))
+    assert rc._deferred is None
+
+
+def test_dynamic_dependencies():
+
+    for cutoff in (False, True):
+        rc = Context(cutoff=cutoff)
+        rc.new_value(flag=True, a=1, c=[2])
+        rc.new_expression('b', lambda env: env.a if env.flag else env.c[0])
+        rc.new_observer('d', lambda env: env.b)
+        rc.run()
+        assert [obj.name for obj in rc['b'].parents] == ['flag', 'a']
+
+        rc.set_value(flag=False)
+        assert rc['d'].value is 2
+        assert [obj.name for obj in rc['b'].parents] == ['flag', 'c']
+        assert rc['b'] not in rc['a'].children
+        rc.set_value(a=10)
+        assert rc['b'].exec_count is 2
+        assert rc['d'].exec_count is 2
+
+        rc.set_value(flag=True)
+        rc.set_value(c=[20])
+        assert rc['d'].value is 10
+        assert rc['b'].exec_count is 3
+
+
+def test_trace_events():
+
+    rc = Context(cutoff=True)
+    events = []
+    rc.add_listener(events.append)
+    rc.new_value(a=1)
+    rc.new_expression('b', lambda env: env.a % 2)
+    rc.memoize('b')
+    rc.new_observer('c', lambda env: env.b)
+    rc.run()
+
+    kinds = [(e.kind, e.node.name if e.node else None, e.depth) for e in events]
+    assert kinds == [('cache_lookup', 'b', 2), ('run', 'b', 2), ('run', 'c', 1), ('flush', None, 0)]
+    assert events[0].cache_hit is False and events[1].cache_hit is None
+    assert all(e.duration >= 0 for e in events)
+    assert events[-1].duration >= events[-2].duration >= events[-3].duration
+    assert 'run(c)' in repr(events[2])
+
+    del events[:]
+    rc.set_value(a=3)
+    kinds = [(e.kind, e.node.name if e.node else None) for e in events]
+    assert kinds == [('invalidate', 'a'), ('stale', 'b'), ('stale', 'c'), ('set_value', 'a'),
+        ('invalidate', 'b'), ('cache_lookup', 'b'), ('cutoff', 'b'), ('run', 'b'), ('flush', None)]
+
+    del events[:]
+    rc.set_value(a=1)
+    assert [e.cache_hit for e in events if e.kind == 'cache_lookup'] == [True]
+
+    rc.remove_listener(events.append)
+    del events[:]
+    rc.set_value(a=5)
+    assert not events
+
+
+def test_stats():
+
+    import time
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_expression('b', lambda env: time.sleep(0.01) or env.a % 2)
+    rc.memoize('b')
+    rc.new_observer('c', lambda env: time.sleep(0.02) or env.b)
+    rc.run()
+    assert all(row['runs'] == 0 for row in rc.stats())
+
+    rc.start_profile()
+    rc.set_value(a=2)
+    rc.set_value(a=1)
+    rc.stop_profile()
+    rc.set_value(a=2)
+
+    stats = rc.stats()
+    assert [row['name'] for row in stats] == ['c', 'b', 'a']
+    b, c = stats[1], stats[0]
+    assert b['runs'] == 1 and c['runs'] == 2 and stats[2]['runs'] == 2
+    assert b['hits'] == 1 and b['misses'] == 1 and c['invalidations'] == 2
+    assert c['total_time'] >= 0.04 and c['self_time'] >= 0.04
+    assert c['total_time'] - c['self_time'] >= 0.01
+    assert b['self_time'] == b['total_time'] == b['last_time'] >= 0.01
+    assert b['size'] == c['size'] > 0
+    assert [row['name'] for row in rc.stats('self_time')] == ['c', 'b', 'a']
+    assert [row['name'] for row in rc.stats(sort=None)] == ['a', 'b', 'c']
+    assert len(str(stats).splitlines()) == 4
+
+    rc.start_profile()
+    assert rc.stats()[0]['runs'] == 0
+
+
+def test_stats_cache_lookup():
+
+    import time
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_expression('x', lambda env: time.sleep(0.02) or env.a)
+    rc.new_expression('b', lambda env: env.x + 1)
+    rc.memoize('b')
+    rc.new_observer('c', lambda env: env.b)
+    rc.run()
+
+    rc.start_profile()
+    rc.set_value(a=2)
+    stats = dict((row['name'], row) for row in rc.stats())
+    assert all(row['self_time'] >= 0 for row in stats.values())
+    assert stats['x']['self_time'] >= 0.02
+    assert stats['c']['total_time'] >= stats['x']['total_time']
+    assert rc.graph().critical_path == ['x', 'b', 'c']
+
+
+def test_trace_recorder(tmpdir):
+
+    import json
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_expression('b', lambda env: env.a + 1)
+    rc.memoize('b')
+    rc.new_observer('c', lambda env: env.b)
+    recorder = rc.start_trace(max_events=5)
+    rc.run()
+
+    events = recorder.events()
+    assert [e['name'] for e in events] == ['cache_lookup(b)', 'run(b)', 'run(c)', 'flush']
+    assert events[0]['args'] == {'cache_hit': False}
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+    assert events[-1]['ts'] <= events[1]['ts'] and events[-1]['dur'] >= events[-2]['dur']
+
+    recorder = rc.start_trace()
+    rc.set_value(a=2)
+    events = recorder.events()
+    assert [e['name'] for e in events] == ['invalidate(a)', 'invalidate(b)', 'invalidate(c)',
+        'set_value(a)', 'cache_lookup(b)', 'run(b)', 'run(c)', 'flush']
+    assert events[0]['ph'] == 'i' and 'dur' not in events[0]
+
+    recorder = rc.start_trace(max_events=3)
+    rc.set_value(a=3)
+    assert [e['name'] for e in recorder.events()] == ['run(b)', 'run(c)', 'flush']
+
+    path = str(tmpdir.join('trace.json'))
+    recorder.dump(path)
+    with open(path) as f:
+        assert json.load(f)['traceEvents'] == recorder.events()
+
+    assert rc.stop_trace() is recorder
+    recorder.clear()
+    rc.set_value(a=4)
+    assert len(recorder) == 0
+
+
+def test_graph():
+
+    import json
+    import time
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_expression('b', lambda env: time.sleep(0.02) or env.a)
+    rc.new_expression('c', lambda env: env.a)
+    rc.new_expression('d', lambda env: env.b + env.c)
+    rc.new_observer('e', lambda env: env.d)
+    rc.new_observer('f', lambda env: env.c)
+    assert rc.graph().critical_path == []
+
+    rc.start_profile()
+    rc.run()
+    graph = rc.graph()
+    assert graph.critical_path == ['b', 'd', 'e']
+    assert sorted((e['source'], e['target']) for e in graph.edges) == [
+        ('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd'), ('c', 'f'), ('d', 'e')]
+    edge = [e for e in graph.edges if e['target'] == 'b'][0]
+    assert edge['time'] >= 0.02 and edge['invalidations'] == 0
+    assert [node['name'] for node in graph.nodes] == list('abcdef')
+    assert [node['kind'] for node in graph.nodes][:2] == ['value', 'expression']
+
+    rc.suspend('e')
+    rc.set_value(a=2)
+    graph = rc.graph()
+    assert graph.critical_path == ['c', 'f']
+    node = dict((node['name'], node) for node in graph.nodes)['e']
+    assert node['invalidated'] and node['suspended'] and node['invalidations'] == 1
+
+    data = json.loads(graph.to_json())
+    assert data['critical_path'] == ['c', 'f'] and len(data['edges']) == 6
+    dot = graph.to_dot()
+    assert dot.startswith('digraph') and '"c" -> "f" [penwidth=' in dot and 'color=red' in dot
+    assert '"e" [shape=hexagon, style="filled,dashed"' in dot
+
+
+def test_concurrent_expressions():
+
+    gevent = importorskip('gevent')
+
+    def query(x):
+        active.append(x)
+        overlap[0] = max(overlap[0], len(active))
+        gevent.sleep(0.05)
+        active.remove(x)
+        return x
+
+    active, overlap = [], [0]
+    rc = Context()
+    rc.new_value(a=1)
+    for name in 'bcdef':
+        rc.new_expression(name, lambda env: gevent.spawn(query, env.a))
+    rc.prefetch('b')
+    rc.new_observer('g', lambda env: sum(env[name] for name in 'bcdef'))
+
+    # the expressions not prefetched yet are waited for one at a time
+    rc.run()
+    assert rc['g'].value == 5
+    assert overlap == [1]
+    assert all(rc[name].prefetch for name in 'bcdef')
+    assert [parent.name for parent in rc['c'].parents] == ['a']
+
+    overlap[0] = 0
+    rc.set_value(a=2)
+    assert rc['g'].value == 10
+    assert overlap == [5] and not active
+    assert all(rc[name].exec_count == 2 for name in 'bcdefg')
+
+    rc.memoize('b')
+    rc.set_value(a=3)
+    rc.set_value(a=4)
+    rc.set_value(a=3)
+    assert rc['b'].exec_count == 4 and rc.cache_info('b')['hits'] == 1
+    assert rc['g'].value == 15
+
+    def failing(x):
+        raise ValueError(x)
+
+    rc.new_expression('h', lambda env: gevent.spawn(failing, env.a))
+    rc.prefetch('h')
+    raises(ValueError, rc['h'].get_value)
+    assert rc['h'].invalidated
+    rc.prefetch('h', False)
+    assert not rc['h'].prefetch and rc['h'] not in rc._prefetched
+
+
+class Handle(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self.value
+
+
+def test_register_future():
+
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_expression('b', lambda env: Handle(env.a))
+    assert isinstance(rc.get_value('b'), Handle) and not rc['b'].prefetch
+
+    try:
+        reactive.register_future(Handle, lambda handle: handle.value * 10)
+        rc.set_value(a=2)
+        assert rc.get_value('b') == 20 and rc['b'].prefetch
+    finally:
+        reactive._futures.unregister(Handle)
+
+
+def test_concurrent_undefined_key():
+
+    gevent = importorskip('gevent')
+    rc = Context()
+    rc.new_expression('a', lambda env: gevent.spawn(lambda x: x * 2, env.x))
+    rc.prefetch('a')
+    rc.new_observer('b', lambda env: env.a)
+    rc.run()
+    assert rc['a'].invalidated and rc['b'].exec_count == 1
+    rc.new_value(x=2)
+    assert rc['b'].exec_count == 2 and rc['b'].value == 4
+    assert [parent.name for parent in rc['a'].parents] == ['x']
+
+
+def test_flush_workers():
+
+    gevent = importorskip('gevent')
+
+    def slow(env):
+        gevent.sleep(0.05)
+        return env.a * 2
+
+    def emit(name):
+        def observer(env):
+            value = env.b + env[name]
+            active.append(name)
+            overlap[0] = max(overlap[0], len(active))
+            gevent.sleep(0.05)
+            active.remove(name)
+            emitted.append(value)
+        return observer
+
+    emitted, active, overlap = [], [], [0]
+    rc = Context(flush_workers=2)
+    rc.new_value(a=1, x=10, y=20, z=30, w=40)
+    rc.new_expression('b', slow)
+    for name in 'xyzw':
+        rc.new_observer('obs_' + name, emit(name))
+
+    rc.run()
+    # the observers run two at a time
+    assert overlap == [2] and not active
+    assert sorted(emitted) == [12, 22, 32, 42]
+    assert rc['b'].exec_count == 1
+    assert sorted(parent.name for parent in rc['obs_x'].parents) == ['b', 'x']
+    assert not rc._call_stack and not rc._running
+
+    del emitted[:]
+    rc.set_value(x=11)
+    assert emitted == [13] and rc['b'].exec_count == 1
+
+    rc.new_observer('copy', lambda env: env(y=env.x + 1))
+    rc.run()
+    assert emitted == [13, 14]
+
+    rc.new_observer('missing', lambda env: env.q)
+    rc.new_observer('failing', lambda env: 1 / (env.a - 2))
+    rc.run()
+    assert rc['missing'].exec_count == 1 and rc['failing'].exec_count == 1
+    del emitted[:]
+    raises(ZeroDivisionError, rc.set_value, a=2)
+    assert sorted(emitted) == [15, 16, 34, 44]
+    rc.new_value(q=1)
+    assert rc['missing'].exec_count == 2
+
+
+def test_flush_workers_dynamic_dependencies():
+
+    importorskip('gevent')
+
+    for cutoff in (False, True):
+        rc = Context(cutoff=cutoff, flush_workers=2)
+        rc.new_value(flag=True, a=1, b=2)
+        rc.new_observer('c', lambda env: env.a if env.flag else env.b)
+        rc.run()
+        assert [obj.name for obj in rc['c'].parents] == ['flag', 'a']
+        assert not rc._running
+
+        rc.set_value(flag=False)
+        assert rc['c'].value == 2 and rc['c'].exec_count == 2
+        assert [obj.name for obj in rc['c'].parents] == ['flag', 'b']
+        assert rc['c'] not in rc['a'].children
+        assert not rc._running
+
+        rc.set_value(a=10)
+        assert rc['c'].exec_count == 2
+        rc.set_value(b=20)
+        assert rc['c'].value == 20 and rc['c'].exec_count == 3
+
+
+def test_threadsafe_expression_get_value():
+
+    rc = Context(threadsafe=True)
+    rc.new_value(a=1, x=5)
+    rc.new_expression('b', lambda env: env.a + 1)
+    rc.new_expression('c', lambda env: env.b + env.x)
+    assert rc['c'].get_value() == 7
+    assert [obj.name for obj in rc['c'].parents] == ['b', 'x']
+    assert rc._lock.owner is None
+    rc.set_value(x=100)
+    assert rc['c'].get_value() == 102
+
+
+def test_threadsafe_stress():
+
+    import threading
+    try:
+        from gevent.monkey import is_module_patched
+        from gevent import sleep
+        if not is_module_patched('thread'):
+            raise ImportError
+    except ImportError:
+        from time import sleep
+
+    n, m = 8, 50
+    names = ['x%d' % i for i in range(n)]
+    rc = Context(threadsafe=True)
+    raises(Exception, Context, threadsafe=True, flush_workers=2)
+    rc.new_value(y=0, **dict.fromkeys(names, 0))
+
+    def total(env):
+        result = 0
+        for name in names:
+            result += env[name]
+            sleep(0)
+        return result
+
+    seen = []
+    rc.new_expression('total', total)
+    rc.new_observer('obs', lambda env: seen.append(env.total))
+    rc.run()
+
+    errors = []
+
+    def worker(target):
+        def run(*args):
+            try:
+                target(*args)
+            except Exception as e:
+                errors.append(e)
+        return run
+
+    @worker
+    def writer(name):
+        for k in range(1, m + 1):
+            rc.set_value(name, k)
+            sleep(0)
+
+    @worker
+    def reader():
+        for k in range(m * 4):
+            assert 0 <= rc.env.total <= n * m
+            assert rc.env.y == 0
+            with ~rc.env:
+                assert rc.env.total >= 0
+            sleep(0)
+
+    threads = [threading.Thread(target=writer, args=(name,)) for name in names]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert rc['total'].value == n * m and seen[-1] == n * m
+    assert sorted(parent.name for parent in rc['total'].parents) == names
+    assert [parent.name for parent in rc['obs'].parents] == ['total']
+    assert not rc['obs'].invalidated and not rc['total'].invalidated
+    assert not rc._call_stack and rc._lock.owner is None
+    assert not rc.env._isolate
+
+
+def test_snapshot():
+
+    rc = Context()
+    rc.new_value(a=1, b=10)
+    rc.new_expression('c', lambda env: env.a + env.b)
+    rc.new_observer('d', lambda env: env.c)
+    rc.run()
+
+    snapshot = rc.snapshot()
+    rc.set_value(a=2)
+    rc.new_value(e=1)
+    assert rc['c'].value == 12
+    assert snapshot['a'] == 1 and snapshot.env.c == 11 and 'c' not in snapshot._computed
+    assert 'e' not in snapshot and 'a' in snapshot
+    raises(UndefinedKey, snapshot.get_value, 'e')
+    raises(Exception, snapshot.get_value, 'd')
+    raises(Exception, setattr, snapshot.env, 'a', 3)
+
+    rc.set_value(b=20)
+    with rc.snapshot() as current:
+        assert (current['a'], current['b'], current['c']) == (2, 20, 22)
+        assert (snapshot['a'], snapshot['b'], snapshot['c']) == (1, 10, 11)
+        assert current.epoch > snapshot.epoch
+    assert current.context is None
+
+    # out-of-date expressions are evaluated within the snapshot
+    rc.new_expression('f', lambda env: env.a * 100)
+    rc.set_value(a=3)
+    with rc.snapshot() as current:
+        assert current['f'] == 300 and rc['f'].exec_count == 0
+    assert snapshot['c'] == 11
+
+    assert rc['a']._history is not None
+    snapshot.close()
+    raises(Exception, snapshot.get_value, 'b')
+    rc.set_value(a=4)
+    assert not rc._touched and rc['a']._history is None and not rc._snapshots
+
+
+def test_snapshot_during_flush():
+
+    for cutoff in (False, True):
+        rc = Context(cutoff=cutoff)
+        rc.new_value(a=1, b=10)
+        rc.new_expression('c', lambda env: env.a + env.b)
+        seen = []
+
+        def observer(env):
+            total = env.c
+            with rc.snapshot() as snapshot:
+                seen.append((total, snapshot['a'], snapshot['b'], snapshot['c']))
+
+        rc.new_observer('d', observer)
+        rc.run()
+        assert seen == [(11, 1, 10, 11)]
+
+        with rc.transaction():
+            rc.set_value(a=2)
+            rc.set_value(b=20)
+        assert seen[-1] == (22, 1, 10, 11)
+        # in cutoff mode, the flush pulls c before running d
+        rc.set_value(a=3)
+        assert seen[-1] == (23, 2, 20, 22)
+        with rc.snapshot() as snapshot:
+            assert snapshot['c'] == 23
+
+
+def test_snapshot_revalidated():
+
+    rc = Context(cutoff=True)
+    rc.new_value(a=0)
+    rc.new_expression('b', lambda env: env.a)
+    rc.new_expression('c', lambda env: env.b * 10)
+    assert rc.get_value('c') == 0
+
+    rc.set_value(a=2)
+    s1 = rc.snapshot()
+    rc.set_value(a=0)
+    assert rc.get_value('c') == 0 and rc['c'].exec_count is 1
+    assert (s1['a'], s1['b'], s1['c']) == (2, 2, 20)
+    s1.close()
+
+    gevent = importorskip('gevent')
+    rc = Context(threadsafe=True)
+    rc.new_value(a=1)
+    rc.new_expression('b', lambda env: gevent.sleep(0.05) or env.a * 2)
+    rc.new_observer('c', lambda env: env.b)
+    rc.run()
+
+    reads = []
+
+    def reader():
+        gevent.sleep(0.01)
+        with rc.snapshot() as snapshot:
+            reads.append((rc._lock.owner is not None, snapshot['a'], snapshot['b']))
+
+    greenlet = gevent.spawn(reader)
+    rc.set_value(a=2)
+    greenlet.join()
+    assert reads == [(True, 1, 2)]
+    with rc.snapshot() as snapshot:
+        assert snapshot['b'] == 4
+
+
+def test_snapshot_threads():
+
+    import threading
+    try:
+        from gevent.monkey import is_module_patched
+        from gevent import sleep
+        if not is_module_patched('thread'):
+            raise ImportError
+    except ImportError:
+        from time import sleep
+
+    rc = Context(threadsafe=True)
+    rc.new_value(a=0)
+    rc.new_expression('b', lambda env: env.a * 2)
+    rc.new_observer('c', lambda env: env.b)
+    rc.run()
+    reads, errors = [], []
+
+    def writer():
+        for i in range(1, 51):
+            rc.set_value(a=i)
+            sleep(0)
+
+    def reader():
+        try:
+            for i in range(50):
+                snapshot = rc.snapshot()
+                sleep(0)
+                a = snapshot['a']
+                sleep(0)
+                reads.append((a, snapshot['b']))
+                snapshot.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer)] + \
+        [threading.Thread(target=reader) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(reads) == 200 and all(b == 2 * a for a, b in reads)
+    assert rc._snapshots == {}
+    rc.set_value(a=0)
+    assert rc['a']._history is None and not rc._touched
+
+
+def test_logging_off():
+
+    class Unprintable(object):
+        def __repr__(self):
+            raise Exception('formatted while logging is off')
+
+    rc = Context()
+    rc.new_value(a=Unprintable())
+    rc.new_observer('b', lambda env: env.a)
+    rc.run()
+    rc.set_value(a=Unprintable())
+    assert rc['b'].exec_count is 2
+    assert rc.log_block('a') is rc.log_block()
+
+
+def test_flush_order():
+
+    def d(env):
+        env.b = env.a * 10
+
+    rc = Context()
+    rc.new_value(a=1, b=0)
+    rc.new_expression('c', lambda env: env.a + 1)
+    rc.new_observer(d=d)
+    rc.new_observer('e', lambda env: env.c + env.b)
+
+    rc.run()
+    assert rc['d'].height < rc['e'].height
+    assert rc['e'].value is 12
+    e_count = rc['e'].exec_count
+
+    rc.set_value(a=2)
+    assert rc['d'].exec_count is 2
+    assert rc['e'].exec_count is e_count + 1
+    assert rc['e'].value is 23
+    assert not rc._flush_queue
+    assert not rc._dirty
+
+
+def test_flush_queue_dedup():
+
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_observer('b', lambda env: env.a)
+    rc.run()
+
+    rc['b'].invalidate()
+    rc['b'].invalidate()
+    assert len(rc._flush_queue) is 1
+    assert rc['b'] in rc._dirty
+    rc.run()
+    assert rc['b'].exec_count is 2
+    assert not rc._dirty
+
+
+def test_transaction():
+
+    seen = []
+    rc = Context()
+    rc.new_value(a=1, b=2)
+    rc.new_observer('c', lambda env: seen.append((env.a, env.b)))
+    rc.run()
+
+    rc.set_value(a=10, b=20)
+    assert rc['c'].exec_count is 2
+    assert seen[-1] == (10, 20)
+
+    with rc.transaction() as env:
+        env.a = 100
+        with rc.transaction():
+            env.b = 200
+        assert rc['c'].exec_count is 2
+    assert rc['c'].exec_count is 3
+    assert seen == [(1, 2), (10, 20), (100, 200)]
+
+    rc.env(a=1, b=2)
+    assert rc['c'].exec_count is 4
+    assert seen[-1] == (1, 2)
+
+    try:
+        with rc.transaction() as env:
+            env.a = 5
+            raise ValueError
+    except ValueError:
+        pass
+    assert rc._transaction_depth is 0
+    assert rc['c'].exec_count is 4
+    rc.flush()
+    assert rc['c'].exec_count is 5
+    assert seen[-1] == (5, 2)
+
+
+def test_transaction_auto_add():
+
+    rc = Context()
+    rc.new_observer('c', lambda env: env.a + env.b)
+    rc.run()
+    assert rc['c'].exec_count is 1
+
+    rc.set_value(a=1, b=2, _auto_add=True)
+    assert 'a' in rc and 'b' in rc
+    assert rc['c'].exec_count is 2
+    assert rc['c'].value is 3
+
+
+def test_cutoff():
+
+    rc = Context(cutoff=True)
+    rc.new_value(v=1)
+    rc.new_expression('parity', lambda env: env.v % 2)
+    rc.new_expression('label', lambda env: 'odd' if env.parity else 'even')
+    rc.new_observer('c', lambda env: env.label)
+
+    rc.run()
+    assert rc['c'].value == 'odd'
+    assert rc['parity'].exec_count is 1
+    assert rc['c'].exec_count is 1
+
+    rc.set_value(v=3)
+    assert rc['parity'].exec_count is 2
+    assert rc['label'].exec_count is 1
+    assert rc['c'].exec_count is 1
+    assert not rc['c'].stale and not rc['c'].invalidated
+    assert not rc._dirty
+
+    rc.set_value(v=4)
+    assert rc['parity'].exec_count is 3
+    assert rc['label'].exec_count is 2
+    assert rc['c'].exec_count is 2
+    assert rc['c'].value == 'even'
+
+
+def test_cutoff_diamond():
+
+    rc = Context(cutoff=True)
+    rc.new_value(v=1, w=0)
+    rc.new_expression('a', lambda env: env.v + 1)
+    rc.new_expression('b', lambda env: env.v * 2)
+    rc.new_observer('c', lambda env: (env.a, env.b, env.w))
+
+    rc.run()
+    rc.set_value(v=2)
+    assert rc['a'].exec_count is 2
+    assert rc['b'].exec_count is 2
+    assert rc['c'].exec_count is 2
+    assert rc['c'].value == (3, 4, 0)
+
+    rc.set_value(w=1)
+    assert rc['a'].exec_count is 2
+    assert rc['b'].exec_count is 2
+    assert rc['c'].exec_count is 3
+
+    rc.suspend('c')
+    rc.set_value(v=3)
+    assert rc['c'].stale
+    assert rc['c'].exec_count is 3
+    rc.resume('c', run=True)
+    assert rc['c'].exec_count is 4
+    assert rc['c'].value == (4, 6, 1)
+
+
+class Hashable(object):
+
+    count = 0
+
+    def __init__(self, x):
+        self.x = x
+
+    def __hash__(self):
+        Hashable.count += 1
+        return hash(self.x)
+
+    def __eq__(self, other):
+        return isinstance(other, Hashable) and self.x == other.x
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def test_versions():
+
+    rc = Context(safe=False)
+    a = rc.new_value(a=Hashable(1))
+    rc.new_expression('b', lambda env: Hashable(env.a.x + 1))
+    rc.new_observer('c', lambda env: env.b)
+    rc.run()
+
+    Hashable.count = 0
+    version = a.version
+    rc.set_value(a=Hashable(1))
+    assert a.version == version
+    rc.set_value(a=Hashable(2))
+    assert a.version > version
+    assert rc['b'].version > a.version
+    assert rc['c'].value.x == 3
+    assert Hashable.count is 0
+
+    assert a.hash == hash(2)
+    assert a.hash == hash(2)
+    assert Hashable.count is 1
+
+    rc = Context(safe=True)
+    a = rc.new_value(a=Hashable(1))
+    Hashable.count = 0
+    rc.set_value(a=Hashable(2))
+    rc.set_value(a=Hashable(3))
+    assert Hashable.count is 0
+    rc.new_expression('b', lambda env: Hashable(env.a.x + 1))
+    assert rc['b'].get_value().x == 4
+    assert Hashable.count > 0
+    assert a._hash_version == a.version and rc['b']._hash_version == rc['b'].version
+
+
 class TestRecursion(object):
 
     def setup(self):
@@ -494,6 +1370,213 @@ def test_safe_mode():
     assert len(a) is 0
 
 
+def test_hashers():
+
+    np = importorskip('numpy')
+    pd = importorskip('pandas')
+    fast_hash = reactive._fast_hash
+
+    x = np.arange(12.).reshape(3, 4)
+    assert fast_hash(x) == fast_hash(x.copy())
+    assert fast_hash(x) != fast_hash(x + 1)
+    assert fast_hash(x) != fast_hash(x.reshape(4, 3))
+    assert fast_hash(x) != fast_hash(x.astype(int))
+    assert fast_hash(x[:, ::2]) == fast_hash(x[:, ::2].copy())
+    assert fast_hash(np.array([[1], 'a'])) == fast_hash(np.array([[1], 'a']))
+    m = np.ma.array([1, 2, 3], mask=[0, 1, 0])
+    assert fast_hash(m) == fast_hash(m.copy())
+    assert fast_hash(m) != fast_hash(np.ma.array([1, 2, 3], mask=[0, 0, 1]))
+    assert fast_hash(m) != fast_hash(m.data)
+
+    dates = pd.date_range('2020', periods=3).values
+    assert fast_hash(dates) == fast_hash(dates.copy())
+    assert fast_hash(dates) != fast_hash(dates[::-1])
+    assert fast_hash(dates) != fast_hash(dates.view('i8'))
+    assert fast_hash(dates - dates[0]) != fast_hash(dates - dates[1])
+    assert fast_hash(dates[::2]) == fast_hash(dates[::2].copy())
+    records = np.zeros(2, dtype=[('t', 'M8[s]'), ('x', 'f8')])
+    assert fast_hash(records) == fast_hash(records.copy())
+    rc = Context()
+    rc.new_value(d=dates)
+    rc.new_observer('e', lambda env: len(env.d))
+    rc.run()
+    rc.set_value(d=dates[:2])
+    assert rc['e'].value is 2
+
+    rc = Context(cutoff=True)
+    rc.new_value(m=m)
+    rc.new_expression('n', lambda env: env.m * 1)
+    rc.new_observer('o', lambda env: env.n.sum())
+    rc.run()
+    rc.set_value(m=np.ma.array([1, 2, 3], mask=[0, 0, 1]))
+    assert rc['o'].value == 3 and rc['o'].exec_count is 2
+
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    assert fast_hash(df) == fast_hash(df.copy())
+    assert fast_hash(df) != fast_hash(df.rename(columns={'a': 'c'}))
+    assert fast_hash(df) != fast_hash(df.set_index('b'))
+    assert fast_hash(df) != fast_hash(df.a)
+    assert fast_hash(df.a) != fast_hash(df.a.astype(float))
+    assert fast_hash(df.index) == fast_hash(pd.RangeIndex(2))
+    df = pd.DataFrame({'a': [[1], [2]]})
+    assert fast_hash(df) == fast_hash(df.copy())
+
+    class Point(object):
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    class Point3D(Point):
+        pass
+
+    try:
+        assert fast_hash(Point(1, 2)) != fast_hash(Point(1, 2))
+        reactive.register_hasher(Point, lambda p: hash((p.x, p.y)))
+        assert fast_hash(Point(1, 2)) == fast_hash(Point3D(1, 2)) == hash((1, 2))
+    finally:
+        reactive._hashers.unregister(Point)
+
+
+def test_comparators():
+
+    np = importorskip('numpy')
+    pd = importorskip('pandas')
+    equal = reactive._values_equal
+
+    x = np.array([1., np.nan, 3.])
+    assert equal(x, x.copy())
+    assert not equal(x, x[:2])
+    assert not equal(x, x.astype(np.float32))
+    assert not equal(x, list(x))
+    assert not equal(np.arange(3), np.arange(1, 4))
+    m = np.ma.array([1, 2, 3], mask=[0, 1, 0])
+    assert equal(m, m.copy())
+    assert not equal(m, np.ma.array([1, 2, 3], mask=[0, 0, 1]))
+    assert not equal(m, np.ma.array([1, 5, 3], mask=[0, 1, 0]))
+    assert not equal(m, m.data)
+
+    df = pd.DataFrame({'a': [1, 2]})
+    assert equal(df, df.copy())
+    assert not equal(df, df.a)
+    assert not equal(df.a, df.a.rename('b'))
+    assert not equal(df, df.rename_axis('i'))
+    assert equal([1, [2, 3]], [1, [2, 3]])
+    assert not equal([1, [2, 3]], [1, [2, 4]])
+
+    for safe in (True, False):
+        rc = Context(safe=safe)
+        rc.new_value(a=np.arange(3), b=pd.DataFrame({'a': [1, 2]}))
+        rc.new_observer('c', lambda env: (env.a.sum(), len(env.b)))
+        rc.run()
+        rc.set_value(a=np.arange(3), b=pd.DataFrame({'a': [1, 2]}))
+        assert rc['c'].exec_count is 1
+        rc.set_value(a=np.arange(4))
+        assert rc['c'].exec_count is 2
+        rc.set_value(b=pd.DataFrame({'a': [1, 2, 3]}))
+        assert rc['c'].exec_count is 3
+        assert rc['c'].value == (6, 3)
+        rc.set_value(a=np.ma.array([1, 2, 3], mask=[0, 1, 0]))
+        rc.set_value(a=np.ma.array([1, 2, 3], mask=[0, 0, 1]))
+        assert rc['c'].exec_count is 5
+        assert rc['c'].value == (3, 3)
+
+    try:
+        reactive.register_comparator(Tagged, lambda a, b: a.tag == b.tag)
+        rc = Context(safe=False)
+        rc.new_value(a=Tagged(1))
+        rc.new_observer('b', lambda env: env.a.tag)
+        rc.run()
+        rc.set_value(a=Tagged(1))
+        assert rc['b'].exec_count is 1
+        rc.set_value(a=Tagged(2))
+        assert rc['b'].exec_count is 2
+    finally:
+        reactive._comparators.unregister(Tagged)
+
+
+def test_safe_mode_tracking(monkeypatch):
+
+    def b1(env):
+        if len(env.a) > 0:
+            env.a.pop()
+        return len(env.a) + len(env.t)
+
+    rc = Context(safe=True)
+    rc.new_value(a=TrackedList([1, 2, 3]), t=(1, 'x'))
+    rc.new_expression(b=b1)
+    rc.new_observer('c', lambda env: env.b)
+    rc.run()
+    assert rc['b'].exec_count is 4
+    assert rc['c'].exec_count is 4
+    assert rc['c'].value is 2
+
+    hashed = []
+
+    def fast_hash(obj):
+        hashed.append(obj)
+        return hash(obj) if not isinstance(obj, list) else reactive.hashing.hash(obj)
+
+    monkeypatch.setattr(reactive, '_fast_hash', fast_hash)
+    rc.run()
+    assert not hashed
+    assert rc['c'].exec_count is 4
+
+    rc['a'].value.append(1)
+    rc.run()
+    assert rc['a'].value == []
+    assert rc['c'].exec_count is 6
+    assert rc['c'].value is 2
+
+
+def test_safe_mode_readonly_array():
+
+    np = importorskip('numpy')
+    rc = Context(safe=True)
+    x = np.array([3])
+    x.flags.writeable = False
+    rc.new_value(a=x)
+    rc.new_observer('b', lambda env: env.a.sum())
+    rc.run()
+    assert rc['a']._unmodified()
+
+    x.flags.writeable = True
+    assert not rc['a']._unmodified()
+    x[0] = 10
+    rc.run()
+    assert rc['b'].value == 10
+    assert rc['b'].exec_count is 2
+
+
+def test_freeze(monkeypatch):
+
+    np = importorskip('numpy')
+    rc = Context(safe=True)
+    a = rc.new_value(a=np.arange(3))
+    b = rc.new_value(b=[1, 2, 3])
+    rc.new_observer('c', lambda env: env.a.sum() + sum(env.b))
+    rc.run()
+    rc.freeze('a')
+    rc.freeze(b)
+    raises(Exception, rc.freeze, 'c')
+    assert a.frozen and b.frozen
+    assert not a.value.flags.writeable
+    raises(ValueError, a.value.__setitem__, 0, 1)
+
+    hashed = []
+    monkeypatch.setattr(reactive, '_fast_hash', lambda obj: hashed.append(obj) or hash(str(obj)))
+    rc.run()
+    rc.set_value(a=a.value)
+    assert not hashed
+    assert rc['c'].exec_count is 1
+
+    rc.set_value(a=np.arange(4))
+    assert not a.value.flags.writeable
+    assert rc['c'].value == 12
+    assert rc['c'].exec_count is 2
+
+    v = Value('v', np.arange(3), frozen=True)
+    assert v.frozen and not v.value.flags.writeable
+
+
 def test_memoize_and_safe_mode():
 
     def b1(env):
@@ -553,6 +1636,306 @@ def test_memoize_and_safe_mode():
     assert len(rc['c'].value) is 1
 
 
+def test_memoize_dependencies():
+
+    rc = Context()
+    rc.new_value(flag=True, x=1, y=2, z=3)
+    rc.new_expression('b', lambda env: env.x if env.flag else env.y * 10)
+    rc.memoize('b')
+    rc.new_observer('c', lambda env: env.b)
+
+    rc.run()
+    assert rc['c'].value is 1
+    assert rc['b']._cache.keys() == [(('flag', 'x'), (stable_hash(True), stable_hash(1)))]
+
+    rc.set_value(flag=False)
+    assert rc['c'].value is 20
+    assert rc['b'].exec_count is 2
+    assert len(rc['b']._cache.signatures()) is 2
+
+    rc.set_value(flag=True)
+    assert rc['c'].value is 1
+    assert rc['b'].exec_count is 2
+
+    rc.set_value(z=30)
+    rc.set_value(flag=False)
+    assert rc['c'].value is 20
+    assert rc['b'].exec_count is 2
+
+    rc.set_value(y=3)
+    assert rc['c'].value is 30
+    assert rc['b'].exec_count is 3
+
+
+def test_hash_collisions():
+
+    assert hash(-1) == hash(-2) and hash(1) == hash(1.0)
+    for cutoff in (False, True):
+        seen = []
+        rc = Context(cutoff=cutoff)
+        rc.new_value(v=1, w=-1)
+        rc.new_expression('e', lambda env: -1 if env.v else -2)
+        rc.new_expression('f', lambda env: env.w * 10)
+        rc.memoize('f')
+        rc.new_observer('o', lambda env: seen.append((env.e, env.f)))
+        rc.run()
+        rc.set_value(v=0)
+        assert seen == [(-1, -10), (-2, -10)]
+        rc.set_value(w=-2)
+        assert seen[-1] == (-2, -20) and rc['f'].exec_count is 2
+        rc.set_value(w=-1)
+        assert seen[-1] == (-2, -10) and rc['f'].exec_count is 2
+
+
+def test_memoize_untaken_branch():
+
+    rc = Context()
+    rc.new_value(x=1, y=1)
+    rc.new_expression('ratio', lambda env: env.x / env.y)
+    rc.new_expression('c', lambda env: env.ratio if env.y != 0 else 0)
+    rc.memoize('c')
+    rc.new_observer('d', lambda env: env.c)
+
+    rc.run()
+    assert rc['d'].value is 1
+    rc.set_value(y=0)
+    assert rc['d'].value is 0
+    assert rc['ratio'].exec_count is 1
+    assert rc['c'].exec_count is 2
+
+    rc.set_value(y=1)
+    assert rc['d'].value is 1
+    assert rc['ratio'].exec_count is 2
+    assert rc['c'].exec_count is 2
+    assert rc.cache_info('c')['hits'] is 1
+
+
+def test_memoize_nested():
+
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_expression('b', lambda env: env.a % 2)
+    rc.new_expression('c', lambda env: env.b + 100)
+    rc.memoize('c')
+    rc.new_observer('d', lambda env: env.c)
+
+    rc.run()
+    rc.set_value(a=2)
+    assert rc['d'].value is 100
+    assert rc['c'].exec_count is 2
+
+    rc.set_value(a=3)
+    assert rc['d'].value is 101
+    assert rc['b'].exec_count is 3
+    assert rc['c'].exec_count is 2
+
+
+def test_memoize_limits():
+
+    rc = Context()
+    rc.new_value(a=0)
+    rc.new_expression('b', lambda env: env.a * 2)
+    rc.memoize('b', max_entries=2)
+    rc.new_observer('c', lambda env: env.b)
+
+    rc.run()
+    for a in [1, 2, 0]:
+        rc.set_value(a=a)
+    assert rc['c'].value is 0
+    assert rc.cache_info('b') == {
+        'hits': 0, 'misses': 4, 'evictions': 2, 'entries': 2, 'nbytes': 0}
+
+    rc.set_value(a=2)
+    assert rc['c'].value is 4
+    assert rc['b'].exec_count is 4
+    assert rc.cache_info('b')['hits'] is 1
+    raises(Exception, rc.cache_info, 'a')
+
+    limits = shared_store.budget.max_entries, shared_store.budget.max_bytes
+    try:
+        rc.memoize('b', pure=True)
+        assert rc['b']._cache.max_entries is 2
+        assert rc['b']._cache.store is shared_store
+        rc.memoize('b')
+        assert rc['b']._cache.store is shared_store
+    finally:
+        shared_store.clear()
+        shared_store.set_limits(*limits)
+
+
+def test_memoize_context_limits():
+
+    rc = Context(max_cache_entries=2)
+    rc.new_value(a=0)
+    rc.new_expression(b=lambda env: env.a * 2, c=lambda env: env.a * 3)
+    rc.memoize('b')
+    rc.memoize('c')
+    rc.new_observer('d', lambda env: (env.b, env.c))
+
+    rc.run()
+    rc.set_value(a=1)
+    assert len(rc['b']._cache) is 1
+    assert len(rc['c']._cache) is 1
+
+    rc.set_value(a=0)
+    assert rc['d'].value == (0, 0)
+    assert rc.cache_info() == {
+        'hits': 0, 'misses': 6, 'evictions': 4, 'entries': 2, 'nbytes': 0}
+
+    rc.memoize('c', False)
+    assert rc['c']._cache is None
+    assert len(rc._cache_budget) is 1
+    rc.set_value(a=1)
+    rc.set_value(a=2)
+    assert len(rc['b']._cache) is 2
+    assert rc['d'].value == (4, 6)
+
+
+def test_memoize_store(tmpdir):
+
+    def make_context(store):
+        rc = Context()
+        rc.new_value(a=[1, 2, 3])
+        rc.new_expression('b', lambda env: sum(env.a))
+        rc.memoize('b', store=store)
+        rc.new_observer('c', lambda env: env.b)
+        rc.run()
+        return rc
+
+    rc = make_context(DiskStore(str(tmpdir)))
+    rc.set_value(a=[4, 5])
+    assert rc['b'].exec_count is 2
+
+    rc = make_context(DiskStore(str(tmpdir)))
+    assert rc['c'].value is 6
+    assert rc['b'].exec_count is 0
+    rc.set_value(a=[4, 5])
+    assert rc['c'].value is 9
+    assert rc['b'].exec_count is 0
+    rc.set_value(a=[6])
+    assert rc['b'].exec_count is 1
+    assert rc.cache_info('b')['hits'] is 2
+
+
+def test_memoize_store_unpicklable(tmpdir):
+
+    import os
+    import threading
+    rc = Context()
+    rc.new_value(a=1, lock=threading.Lock())
+    rc.new_expression('b', lambda env: (x for x in [env.a]))
+    rc.new_expression('c', lambda env: (env.lock, env.a))
+    rc.memoize('b', store=DiskStore(str(tmpdir)))
+    rc.memoize('c', store=DiskStore(str(tmpdir)))
+    rc.new_observer('d', lambda env: (env.b, env.c))
+    rc.run()
+    assert rc['b'].exec_count is 1 and rc['c'].exec_count is 1
+    rc.set_value(a=2)
+    assert rc['c'].value[1] is 2
+    for root, dirs, files in os.walk(str(tmpdir)):
+        assert not any(name.startswith('tmp') for name in dirs)
+    assert DiskStore(str(tmpdir)).signatures(rc['b']._cache.namespace) == []
+
+
+def test_memoize_store_closure(tmpdir):
+
+    def make_context(func):
+        rc = Context()
+        rc.new_value(a=1)
+        rc.new_expression('b', func)
+        rc.memoize('b', store=DiskStore(str(tmpdir)))
+        rc.new_observer('c', lambda env: env.b)
+        rc.run()
+        return rc
+
+    def scale(n):
+        return lambda env: env.a * n
+
+    assert make_context(scale(2))['c'].value is 2
+    rc = make_context(scale(3))
+    assert rc['c'].value is 3
+    assert rc['b'].exec_count is 1
+    assert make_context(scale(3))['b'].exec_count is 0
+
+    rc = Context()
+    rc.new_value(a=1)
+    rc.new_expression('b', scale(x for x in [1]))
+    raises(Exception, rc.memoize, 'b', store=DiskStore(str(tmpdir)))
+    assert not rc['b'].memoized
+    rc.memoize('b')
+    assert rc['b'].memoized
+
+
+class Tagged(object):
+
+    def __init__(self, tag):
+        self.tag = tag
+
+
+def test_memoize_pure():
+
+    def table(env):
+        return [env.tag] * env.n
+
+    def make_context(tag):
+        rc = Context()
+        rc.new_value(tag=tag, n=3, obj=Tagged(tag))
+        rc.new_expression('b', table)
+        rc.new_expression('c', lambda env: env.obj.tag)
+        rc.memoize('b', pure=True)
+        rc.memoize('c', pure=True)
+        rc.new_observer('d', lambda env: (env.b, env.c))
+        rc.run()
+        return rc
+
+    shared_store.clear()
+    try:
+        rc1 = make_context('x')
+        rc2 = make_context('x')
+        assert rc2['d'].value == (['x'] * 3, 'x')
+        assert rc1['b'].exec_count is 1 and rc2['b'].exec_count is 0
+        assert rc1['c'].exec_count is 1 and rc2['c'].exec_count is 0
+
+        rc3 = make_context('y')
+        assert rc3['d'].value == (['y'] * 3, 'y')
+        assert rc3['b'].exec_count is 1 and rc3['c'].exec_count is 1
+
+        rc2.set_value(tag='y', n=2)
+        assert rc2['b'].exec_count is 1
+        rc3.set_value(n=2)
+        assert rc3['b'].exec_count is 1
+        assert rc3['b'].value == ['y', 'y']
+    finally:
+        shared_store.clear()
+
+
+def test_memoize_pure_collisions():
+
+    def double(env):
+        return env.x * 2
+
+    def make_context(x):
+        rc = Context()
+        rc.new_value(x=x)
+        rc.new_expression('b', double)
+        rc.memoize('b', pure=True)
+        rc.new_observer('c', lambda env: env.b)
+        rc.run()
+        return rc
+
+    assert hash(-1) == hash(-2) and hash(1) == hash(1.0)
+    shared_store.clear()
+    try:
+        assert make_context(-1)['c'].value == -2
+        assert make_context(-2)['c'].value == -4
+        assert make_context(1)['c'].value == 2
+        rc = make_context(1.0)
+        assert rc['c'].value == 2.0 and type(rc['c'].value) is float
+        assert make_context(-2)['b'].exec_count is 0
+    finally:
+        shared_store.clear()
+
+
 def test_external_access():
 
     rc = Context()
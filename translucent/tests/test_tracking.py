@@ -0,0 +1,72 @@
+# -*- coding: utf-8
+
+from translucent import patch_thread
+patch_thread()
+
+from translucent.tracking import TrackedList, TrackedDict, mutation_stamp, freeze, IMMUTABLE
+from translucent.memo import stable_hash
+
+from pytest import raises, importorskip
+
+
+def test_mutation_stamp():
+
+    for value in (None, 1, 1.5, 'a', u'b', (1, ('a', None)), frozenset([1, 2]), len):
+        assert mutation_stamp(value) is IMMUTABLE
+    for value in ([], {}, set(), (1, []), object()):
+        assert mutation_stamp(value) is None
+
+
+def test_mutation_stamp_numpy():
+
+    np = importorskip('numpy')
+    x = np.arange(10)
+    assert mutation_stamp(x) is None
+    x.flags.writeable = False
+    assert mutation_stamp(x) is IMMUTABLE
+    assert mutation_stamp(x[2:]) is IMMUTABLE
+    y = np.arange(10)
+    view = y[2:]
+    view.flags.writeable = False
+    assert mutation_stamp(view) is None
+
+
+def test_tracked_list():
+
+    x = TrackedList([1, 2, 3])
+    assert mutation_stamp(x) is 0
+    x.append(4)
+    x[0] = 0
+    x += [5]
+    x.sort()
+    del x[1:2]
+    assert x == [0, 3, 4, 5]
+    assert mutation_stamp(x) is 5
+    assert stable_hash(x) == stable_hash(TrackedList([0, 3, 4, 5]))
+
+
+def test_tracked_dict():
+
+    x = TrackedDict(a=1)
+    assert mutation_stamp(x) is 0
+    x['b'] = 2
+    x.update(c=3)
+    x.pop('a')
+    assert x == {'b': 2, 'c': 3}
+    assert mutation_stamp(x) is 3
+    assert stable_hash(x) == stable_hash(TrackedDict(c=3, b=2))
+
+
+def test_freeze():
+
+    np = importorskip('numpy')
+    pd = importorskip('pandas')
+    assert freeze([1]) == [1]
+    x = freeze(np.arange(3))
+    assert mutation_stamp(x) is IMMUTABLE
+    df = freeze(pd.DataFrame({'a': [1, 2], 'b': [1., 2.], 'c': ['x', 'y']}))
+    raises(ValueError, df.b.values.__setitem__, 0, 10)
+    raises(ValueError, df.a.values.__setitem__, 0, 10)
+    s = freeze(pd.Series([1., 2.]))
+    raises(ValueError, s.values.__setitem__, 0, 10)
+    assert mutation_stamp(df) is None
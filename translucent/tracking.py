@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ('TrackedList', 'TrackedDict', 'mutation_stamp', 'freeze', 'IMMUTABLE')
+
+import types
+
+IMMUTABLE = object()
+
+_IMMUTABLE_TYPES = (types.NoneType, bool, int, long, float, complex, str, unicode,
+    types.FunctionType, types.BuiltinFunctionType, type)
+
+
+def mutation_stamp(value):
+    """
+    Returns a cheap token describing the in-place mutation state of a value.
+
+    The token is :data:`IMMUTABLE` for values that cannot change in place (scalars,
+    strings, tuples and frozensets thereof and numpy arrays that are not writeable),
+    the mutation counter for :class:`TrackedList` and :class:`TrackedDict` values,
+    and `None` if nothing is known about the value, in which case the only way to
+    tell whether it changed is to hash it again.
+    """
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return IMMUTABLE
+    if isinstance(value, _Tracked):
+        return value.mutations
+    if isinstance(value, (tuple, frozenset)):
+        if all(mutation_stamp(item) is IMMUTABLE for item in value):
+            return IMMUTABLE
+        return None
+    if _is_pandas(value):
+        return None
+    flags = getattr(value, 'flags', None)
+    if flags is not None and hasattr(flags, 'writeable') and hasattr(value, 'base'):
+        while value is not None and hasattr(value, 'flags'):
+            if value.flags.writeable:
+                return None
+            value = value.base
+        return IMMUTABLE
+    return None
+
+
+def freeze(value):
+    """
+    Makes a numpy array, or the blocks of a pandas object, read-only in place and
+    returns the value. Other values are returned as is.
+
+    Note that a frozen pandas object can still be modified in ways that do not write
+    to its blocks (e.g. by adding a column or renaming its index), so its mutation
+    stamp remains unknown.
+    """
+    if _is_pandas(value):
+        data = getattr(value, '_mgr', getattr(value, '_data', None))
+        for block in getattr(data, 'blocks', ()):
+            freeze(block.values)
+        if hasattr(data, 'flags'):
+            freeze(data)
+        return value
+    flags = getattr(value, 'flags', None)
+    if flags is not None and hasattr(flags, 'writeable'):
+        flags.writeable = False
+    return value
+
+
+def _is_pandas(value):
+    return type(value).__module__.split('.')[0] == 'pandas'
+
+
+class _Tracked(object):
+
+    mutations = 0
+
+    def _mutated(self):
+        self.mutations += 1
+
+
+def _tracking(name, base):
+    method = getattr(base, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._mutated()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class TrackedList(_Tracked, list):
+
+    """
+    List that counts its in-place modifications.
+
+    A reactive context in safe mode needs to re-hash a mutable value after every run
+    that could have modified it; for a value wrapped in a tracked container it only
+    compares the mutation counter instead. Only the container itself is tracked,
+    modifications of mutable items it holds are not detected.
+
+    Examples
+    --------
+    >>> from translucent.reactive import Context
+    >>> rc = Context()
+    >>> a = rc.new_value(a=TrackedList([1, 2, 3]))
+    >>> a.value.append(4)
+    >>> a.value.mutations
+    1
+    """
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+class TrackedDict(_Tracked, dict):
+
+    """
+    Dictionary that counts its in-place modifications (see :class:`TrackedList`).
+    """
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+for _name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__',
+        '__imul__', 'append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(TrackedList, _name, _tracking(_name, list))
+
+for _name in ('__setitem__', '__delitem__', 'clear', 'pop', 'popitem', 'setdefault', 'update'):
+    setattr(TrackedDict, _name, _tracking(_name, dict))
+
+del _name